@@ -1,23 +1,47 @@
 import os          # para manejar rutas de archivos y carpetas
 import threading   # para ejecutar el motor en segundo plano
+import asyncio     # para manejar los procesos del motor en un solo bucle de fondo
 import queue       # para comunicacion entre hilos
 import time        # para pausas (sleep) en errores visuales
 import chess       # libreria de ajedrez con todas las reglas
 import chess.engine # para conectar con el motor Stockfish
+import chess.polyglot # para el hash Zobrist y el libro de aperturas
+import json        # para guardar el cache de analisis en disco
+from collections import OrderedDict, deque  # para el cache LRU de analisis y las mediciones
 import FreeSimpleGUI as sg  # para crear la interfaz grafica
+import tkinter as tk  # para crear las imagenes de las piezas en memoria
+import base64      # para pasar los PNG en memoria a tkinter
 import platform    # para detectar sistema operativo
-import zipfile     # para descomprimir archivos zip
-import tarfile     # para descomprimir archivos tar
-import shutil      # para mover y copiar archivos
-import urllib.request  # para descargar el motor de internet
+import sys         # para leer los argumentos de la linea de comandos
+import argparse    # para los modos sin ventana (partidas entre motores)
+
+# Los modulos que solo se usan para descargar el motor (zipfile, tarfile, shutil,
+# urllib), para las tablas de finales o en los modos sin ventana (chess.pgn,
+# concurrent.futures, tracemalloc) se importan dentro de las funciones que los
+# usan: asi la ventana abre antes, sobre todo en la tarjeta SD de la Raspberry Pi
 
 # --- SECCION 1: CONFIGURACION INICIAL DEL PROGRAMA ---
 
 # Nombre que aparece en la ventana del juego
 APP_TITLE = 'Ajedrez'
 
+# Carpeta con los juegos de imagenes (una subcarpeta por tamano)
+IMG_ROOT = 'Images'
+
+# Tamano de las imagenes de las piezas en pixeles (debe existir Images/<tamano>)
+IMG_SIZE = 60
+
 # Ruta donde estan guardadas las imagenes de las piezas
-IMG_PATH = 'Images/60'
+IMG_PATH = os.path.join(IMG_ROOT, str(IMG_SIZE))
+
+# Como se dibuja el tablero: "buttons" (64 botones) o "canvas" (un solo lienzo)
+# kchess.json lo puede cambiar con "board_renderer"
+BOARD_RENDERER = "buttons"
+
+# Lado de cada casilla del lienzo en pixeles (None = tamano de las imagenes)
+# Con casillas mas grandes se usa el juego de imagenes mas grande que entra
+# kchess.json lo puede cambiar con "canvas_square"
+CANVAS_SQUARE_SIZE = None
 
 # Carpeta donde se guardara el motor de ajedrez (cerebro del bot)
 ENGINE_FOLDER = "engines"
@@ -29,6 +53,150 @@ ENGINE_NAME = "stockfish.exe" if platform.system() == "Windows" else "stockfish"
 # Ruta completa al motor combinando carpeta y nombre
 ENGINE_PATH = os.path.join(ENGINE_FOLDER, ENGINE_NAME)
 
+# Libro de aperturas Polyglot (opcional, si no existe se usa solo el motor)
+BOOK_PATH = os.path.join(ENGINE_FOLDER, "book.bin")
+
+# Carpeta con tablas de finales Syzygy (opcional, archivos .rtbw y .rtbz)
+SYZYGY_PATH = os.path.join(ENGINE_FOLDER, "syzygy")
+
+# Cantidad maxima de piezas para consultar las tablas de finales
+SYZYGY_MAX_PIECES = 5
+
+# Archivo opcional donde el operador puede cambiar el perfil del motor
+# Ejemplo: {"pool_size": 2, "options": {"Threads": 2, "Hash": 128},
+#           "limits": {"bot": "time=0.4", "assistant": "depth=12"}}
+CONFIG_FILE = "kchess.json"
+
+# Cantidad de procesos del motor que se mantienen abiertos todo el programa
+# Con 2 el bot y el asistente pueden pensar al mismo tiempo
+ENGINE_POOL_SIZE = 2
+
+# Cantidad maxima de busquedas del motor al mismo tiempo
+# Nunca debe ser mayor que ENGINE_POOL_SIZE para no dejar pedidos esperando motor
+MAX_ENGINE_SEARCHES = ENGINE_POOL_SIZE
+
+# Segundos que se espera la respuesta a isready antes de reiniciar el motor
+ENGINE_PING_TIMEOUT = 2
+
+# Segundos extra sobre el limite de busqueda antes de dar el motor por colgado
+ENGINE_TIMEOUT = 5
+
+# Segundos maximos de una busqueda por profundidad o nodos (sin tiempo en el limite)
+# antes de dar el motor por colgado (None = esperar siempre)
+ENGINE_SEARCH_TIMEOUT = 300
+
+# Limite de cada busqueda del motor segun quien la pide (0.4 segundos para que sea rapido)
+# main los ajusta al hardware con detect_engine_profile
+ENGINE_LIMITS = {
+    "bot": chess.engine.Limit(time=0.4),
+    "assistant": chess.engine.Limit(time=0.4),
+}
+
+# El bot piensa en el tiempo del jugador sobre la respuesta que espera (ponder)
+BOT_PONDER = True
+
+# Cada cuanto se mira si el ponder acertado ya llego a la profundidad o nodos del bot
+PONDER_CHECK_INTERVAL = 0.02
+
+# Modo de analisis continuo del asistente: muestra varias lineas que mejoran
+# mientras el jugador piensa (False = una sola busqueda con el limite del asistente)
+ASSISTANT_ANALYSIS_MODE = True
+
+# Cantidad de lineas (MultiPV) que muestra el analisis continuo
+ANALYSIS_MULTIPV = 3
+
+# Tiempo maximo de analisis continuo por posicion en segundos (None = sin limite)
+ANALYSIS_MAX_TIME = 60
+
+# Tiempo maximo de analisis continuo en equipos de 1 o 2 nucleos (Raspberry Pi)
+ANALYSIS_SMALL_MAX_TIME = 5
+
+# Tiempo minimo entre actualizaciones del analisis en pantalla (segundos)
+ANALYSIS_UPDATE_INTERVAL = 0.15
+
+# Cantidad maxima de posiciones guardadas en el cache de analisis
+ANALYSIS_CACHE_SIZE = 5000
+
+# Archivo donde se guarda el cache de analisis entre sesiones (None = no guardar)
+ANALYSIS_CACHE_FILE = os.path.join(ENGINE_FOLDER, "analysis_cache.json")
+
+# Cache propio del modo annotate: puede juntar cientos de miles de posiciones
+# y no debe agrandar el que la ventana lee en cada arranque
+ANNOTATE_CACHE_FILE = os.path.join(ENGINE_FOLDER, "annotate_cache.json")
+
+# Partidas que el modo annotate analiza a la vez (se escriben en el orden del archivo)
+ANNOTATE_IN_FLIGHT = 4
+
+# Evento que mandan los hilos del motor para despertar a la ventana
+ENGINE_EVENT = '-ENGINE-'
+
+# Registro de mediciones (una linea JSON por evento) para diagnosticar demoras
+# Se puede cambiar en kchess.json: {"metrics": {"log": ..., "status": ..., "port": ...}}
+# None = no guardar
+METRICS_LOG_FILE = os.path.join(ENGINE_FOLDER, "metrics.jsonl")
+
+# Tamano maximo del registro; al pasarlo el anterior queda como .1
+METRICS_LOG_MAX_BYTES = 1024 * 1024
+
+# Archivo JSON con el resumen actual que se reescribe cada METRICS_INTERVAL (None = no escribir)
+METRICS_STATUS_FILE = None
+
+# Puerto local (solo 127.0.0.1) para leer el resumen por HTTP (None = apagado)
+METRICS_PORT = None
+
+# Segundos entre muestras de recursos (hilos, CPU y memoria de cada motor)
+METRICS_INTERVAL = 5
+
+# Segundos entre escrituras del registro; las lineas se juntan y un hilo las
+# escribe de una vez, asi dibujar el tablero nunca espera al disco
+METRICS_FLUSH_INTERVAL = 1.0
+
+# Lineas maximas esperando a escribirse (si el disco se traba se pierden las mas viejas)
+METRICS_PENDING_MAX = 10000
+
+# Salidas de LEDs (un LED por casilla, indice 0 = a1 ... 63 = h8)
+# Se configuran en kchess.json, por ejemplo:
+# {"leds": [{"type": "device", "path": "/dev/ttyUSB0"}, {"type": "file", "path": "leds.jsonl"}]}
+# "device" manda paquetes binarios a un puerto serie o SPI, "file" escribe JSON por linea
+# (sirve tambien para una tuberia creada con mkfifo)
+LED_SINKS = []
+
+# Maximo de actualizaciones por segundo que se mandan a los LEDs
+# Los cambios mas rapidos se juntan y solo se manda el ultimo cuadro
+LED_MAX_FPS = 30
+
+# Cantidad de mediciones recientes que se guardan de cada tipo para los promedios
+METRICS_SAMPLES = 200
+
+# Servidor para espectadores y juego remoto por TCP (None = apagado)
+# Cada cliente recibe una linea JSON con el estado completo al conectarse
+# y despues solo los cambios de cada jugada
+# Se puede cambiar en kchess.json: {"spectator": {"port": 8766, "host": "0.0.0.0", "token": "clave"}}
+SPECTATOR_PORT = None
+SPECTATOR_HOST = "127.0.0.1"
+
+# Clave que un cliente debe mandar para poder mover (None = solo mirar)
+SPECTATOR_TOKEN = None
+
+# Mensajes pendientes por cliente; a un cliente lento que junta mas se le
+# descartan y recibe de nuevo el estado completo cuando se pone al dia
+SPECTATOR_QUEUE = 64
+
+# Registro de la partida en disco para recuperarla despues de un corte de luz
+# (None = no se guarda). Se puede cambiar en kchess.json: {"journal": "ruta"}
+JOURNAL_FILE = os.path.join(ENGINE_FOLDER, "journal.log")
+
+# Segundos maximos entre escrituras forzadas al disco (fsync)
+# Se juntan todas las jugadas de ese intervalo en una sola escritura
+JOURNAL_SYNC_INTERVAL = 1.0
+
+# Lineas que se agregan antes de reescribir el registro como un solo estado completo
+JOURNAL_COMPACT_LINES = 500
+
+# Archivo PGN donde se agregan las partidas terminadas (None = no se exportan)
+# Se puede cambiar en kchess.json: {"pgn_export": "partidas.pgn"}
+PGN_EXPORT_FILE = None
+
 # Diccionario con todos los colores que usa el programa
 # Cada color tiene un nombre descriptivo y su codigo hexadecimal
 COLORS = {
@@ -51,104 +219,197 @@ PIECE_IMAGES = {
     'P': 'wP.png', 'N': 'wN.png', 'B': 'wB.png', 'R': 'wR.png', 'Q': 'wQ.png', 'K': 'wK.png'
 }
 
+# Imagen de la casilla vacia (se guarda con la clave '.')
+BLANK_IMAGE = 'blank.png'
+
 # --- SECCION 2: VARIABLES GLOBALES DEL JUEGO ---
 
-# Objeto que representa el tablero de ajedrez con todas sus reglas
-board = chess.Board()
+# El estado de cada partida (tablero, seleccion, sugerencia, modos y pedidos
+# al motor) esta en un objeto GameSession (SECCION 3). La ventana muestra la
+# sesion session; HeadlessDriver maneja muchas sesiones en el mismo proceso
 
-# Cola para recibir movimientos del bot (como una fila de espera)
-move_queue = queue.Queue()
+# Conjunto de botones que estan esperando confirmacion
+confirm_states = set()
 
-# Cola para recibir sugerencias del asistente
-suggestion_queue = queue.Queue()
+# Indica si se muestran las mediciones (tiempos y recursos) debajo del tablero
+is_metrics_visible = False
 
-# Casilla que el jugador tiene seleccionada actualmente
-selected_square = None
+# Texto de estado del motor mientras arranca en segundo plano (vacio cuando esta listo)
+engine_status = ""
 
-# Diccionario con los movimientos validos desde la casilla seleccionada
-valid_moves_squares = {}
+# Cola con los avisos del arranque del motor: ("status", texto), ("ready", datos) o ("error", texto)
+bootstrap_queue = queue.Queue()
 
-# Movimiento que el motor sugiere al jugador
-engine_suggestion = None
+# Servicio con los motores abiertos (se crea en main despues de ensure_engine)
+engine_service = None
 
-# Indica si el modo bot esta activado
-is_bot_enabled = False
+# Ventana que se despierta cuando el motor termina (se asigna en main)
+engine_window = None
 
-# Indica si el asistente esta activado
-is_assistant_enabled = False
+# Cache de resultados del motor por posicion (se crea en main)
+analysis_cache = None
 
-# Conjunto de botones que estan esperando confirmacion
-confirm_states = set()
+# Libro de aperturas y tablas de finales abiertos (None si no hay archivos)
+opening_book = None
+tablebase = None
+
+# Ultimo estado dibujado de cada casilla: (fila, columna) -> (imagen, color)
+# Sirve para redibujar solo las casillas que cambiaron
+drawn_squares = {}
+
+# Ultimo estado dibujado de cada boton o texto de control
+drawn_controls = {}
 
-# Indica si ya se mostro el mensaje de fin de juego
-game_over_notified = False
+# Bytes de los PNG ya leidos del disco: tamano -> {simbolo: bytes}
+piece_image_data = {}
+
+# Imagenes de tkinter ya decodificadas: simbolo -> PhotoImage
+# Las 64 casillas comparten estas 13 imagenes
+piece_photos = {}
+
+# Salida de los colores del tablero a los LEDs (None si no hay LEDs configurados)
+led_output = None
+
+# Tablero dibujado en un solo lienzo (None si se usan los 64 botones)
+board_canvas = None
+
+# Servidor de espectadores y juego remoto (None si no esta configurado)
+spectator_server = None
 
 # --- SECCION 3: FUNCIONES AUXILIARES ---
 
-def reset_selection():
-    # Limpia todas las variables de seleccion
-    # Se usa cuando el jugador hace un movimiento o cancela
-    global selected_square, valid_moves_squares
-    selected_square = None
-    valid_moves_squares = {}
-    # NO limpiamos engine_suggestion aqui para que persista
+# Colores base del tablero (sin resaltados) indexados por casilla
+# Se calculan una sola vez: casilla oscura si fila + columna es par
+BASE_FRAME = tuple(
+    COLORS["DARK"] if (chess.square_rank(sq) + chess.square_file(sq)) % 2 == 0 else COLORS["LIGHT"]
+    for sq in chess.SQUARES
+)
+
+def compute_frame():
+    # Colores de las 64 casillas de la partida que muestra la ventana
+    # Devuelve una tupla indexada por casilla (0 = a1, 63 = h8)
+    # Sirve para la interfaz y para modulos externos (por ejemplo LEDs)
+    return session.compute_frame()
 
 def get_sq_color(sq_idx):
-    # Calcula que color debe tener cada casilla del tablero
-    # Recibe el indice de la casilla y devuelve un color
-    
-    # Obtiene la fila y columna de la casilla
-    sq_rank, sq_file = chess.square_rank(sq_idx), chess.square_file(sq_idx)
-    
-    # Calcula si es casilla oscura o clara del tablero
-    is_dark = (sq_rank + sq_file) % 2 == 0
-    
-    # Asigna color base segun si es oscura o clara
-    base = COLORS["DARK"] if is_dark else COLORS["LIGHT"]
-
-    # PRIORIDAD 1: Si es la casilla seleccionada la pinta de color cyan
-    if sq_idx == selected_square:
-        return COLORS["SELECTED"]
-
-    # PRIORIDAD 2: Capturas y movimientos especiales tienen alta prioridad
-    if sq_idx in valid_moves_squares:
-        move = valid_moves_squares[sq_idx]
-        # Si el movimiento captura una pieza la pinta amarilla
-        if board.is_capture(move): 
-            return COLORS["CAPTURE"]
-        # Si es movimiento especial la pinta magenta
-        if board.is_en_passant(move) or board.is_castling(move): 
-            return COLORS["SPECIAL"]
-
-    # PRIORIDAD 3: Si el asistente esta activo y hay una sugerencia
-    # El color del asistente tiene prioridad sobre movimientos validos normales
-    if is_assistant_enabled and engine_suggestion and engine_suggestion in board.legal_moves:
-        # Pinta las casillas de origen y destino de la sugerencia
-        if sq_idx in (engine_suggestion.from_square, engine_suggestion.to_square):
-            # No muestra sugerencia cuando es turno del bot
-            if not (is_bot_enabled and board.turn == chess.BLACK):
-                # Color diferente segun quien juega
-                return COLORS["SUGGESTED_P1"] if board.turn == chess.WHITE else COLORS["SUGGESTED_P2"]
-    
-    # PRIORIDAD 4: Movimientos validos normales (verde)
-    if sq_idx in valid_moves_squares:
-        # Movimientos normales usan verde claro u oscuro
-        return COLORS["VALID_DARK"] if is_dark else COLORS["VALID_LIGHT"]
-    
-    # Si no es ninguno de los casos anteriores usa color base
-    return base
-
-def update_ui(window):
-    # Actualiza toda la interfaz grafica del programa
+    # Devuelve el color que debe tener una casilla del tablero
+    # Lee del cuadro completo, que se calcula una sola vez por estado
+    return session.compute_frame()[sq_idx]
+
+def available_image_sizes():
+    # Devuelve los tamanos de imagenes disponibles (subcarpetas numericas de Images)
+    if not os.path.isdir(IMG_ROOT):
+        return []
+    return sorted(int(d) for d in os.listdir(IMG_ROOT) if d.isdigit() and os.path.isdir(os.path.join(IMG_ROOT, d)))
+
+def load_piece_images(size=IMG_SIZE):
+    # Lee una sola vez del disco los 13 PNG de un tamano (12 piezas + casilla vacia)
+    # Despues de esto dibujar el tablero no vuelve a abrir archivos
+    if size in piece_image_data:
+        return piece_image_data[size]
+    folder = os.path.join(IMG_ROOT, str(size))
+    images = {}
+    for symbol, filename in list(PIECE_IMAGES.items()) + [('.', BLANK_IMAGE)]:
+        with open(os.path.join(folder, filename), 'rb') as f:
+            images[symbol] = f.read()
+    piece_image_data[size] = images
+    return images
+
+def build_piece_photos(size=IMG_SIZE):
+    # Decodifica los PNG en imagenes de tkinter una sola vez
+    # Necesita que la ventana ya exista (tkinter pide una raiz creada)
+    piece_photos.clear()
+    for symbol, data in load_piece_images(size).items():
+        piece_photos[symbol] = tk.PhotoImage(data=base64.b64encode(data))
+
+def set_square_image(element, symbol):
+    # Pone en el boton la imagen ya decodificada de la pieza
+    photo = piece_photos[symbol]
+    element.Widget.config(highlightthickness=0, image=photo, width=photo.width(), height=photo.height())
+    # Guarda una referencia para que tkinter no borre la imagen
+    element.Widget.image = photo
+
+class CanvasBoard:
+    # Tablero dibujado en un solo lienzo de Tk (el de un sg.Graph)
+    # Cada casilla es un rectangulo y cada pieza una imagen del lienzo que se
+    # crean una sola vez; al mover solo se recolorean o cambian de imagen los
+    # items de las casillas que cambiaron, sin tocar 64 widgets
+    # Los clics llegan como un punto y se convierten a casilla por coordenadas
+    
+    def __init__(self, canvas, square_size):
+        # canvas es el lienzo de Tk (window['-BOARD-'].Widget)
+        self.canvas = canvas
+        self.size = square_size
+        # Items del lienzo por casilla: (fila, columna) -> id
+        self.squares = {}
+        self.pieces = {}
+        for r in range(8):
+            for f in range(8):
+                # El lienzo cuenta y hacia abajo: la fila 7 queda arriba
+                x, y = f * square_size, (7 - r) * square_size
+                self.squares[(r, f)] = canvas.create_rectangle(
+                    x, y, x + square_size, y + square_size,
+                    fill=BASE_FRAME[chess.square(f, r)], width=0)
+                # La imagen se crea oculta y se muestra cuando hay una pieza
+                self.pieces[(r, f)] = canvas.create_image(
+                    x + square_size // 2, y + square_size // 2, state='hidden')
+    
+    def paint(self, key, img, color, previous=None):
+        # Dibuja una casilla tocando solo lo que cambio desde previous (imagen, color)
+        if previous is None or previous[1] != color:
+            self.canvas.itemconfig(self.squares[key], fill=color)
+        if previous is None or previous[0] != img:
+            if img == '.':
+                self.canvas.itemconfig(self.pieces[key], state='hidden')
+            else:
+                self.canvas.itemconfig(self.pieces[key], image=piece_photos[img], state='normal')
+    
+    def square_at(self, point):
+        # Convierte el punto del clic (x, y con origen abajo a la izquierda)
+        # en la clave (fila, columna) de la casilla; None si cae fuera
+        if point is None or point[0] is None:
+            return None
+        f, r = int(point[0] // self.size), int(point[1] // self.size)
+        if 0 <= f < 8 and 0 <= r < 8:
+            return (r, f)
+        return None
+
+def update_control(window, key, **kwargs):
+    # Actualiza un boton o texto de control solo si algo cambio
+    state = tuple(sorted(kwargs.items()))
+    if drawn_controls.get(key) != state:
+        drawn_controls[key] = state
+        window[key].update(**kwargs)
+
+def update_ui(window, full=False):
+    # Actualiza la interfaz grafica del programa
     # Se llama cada vez que algo cambia en el juego
-    global game_over_notified
+    # Solo toca las casillas y botones que cambiaron desde el ultimo dibujo
+    # Con full=True redibuja todo (reinicio, cambio de modo o carga de FEN)
+    start = time.perf_counter()
+    
+    # Olvida lo dibujado para forzar el redibujo completo
+    if full:
+        drawn_squares.clear()
+        drawn_controls.clear()
     
     # Determina el texto del jugador 2 segun el modo
-    p2_label = "BOT" if is_bot_enabled else "JUGADOR 2"
+    p2_label = "BOT" if session.is_bot_enabled else "JUGADOR 2"
     
     # Actualiza las etiquetas de los jugadores
-    window['-LABEL-P1-'].update("JUGADOR 1")
-    window['-LABEL-P2-'].update(p2_label)
+    update_control(window, '-LABEL-P1-', value="JUGADOR 1")
+    update_control(window, '-LABEL-P2-', value=p2_label)
+
+    # Calcula los colores de todo el tablero de una vez
+    frame = session.compute_frame()
+    
+    # Manda el cuadro a los LEDs (el envio corre en su propio hilo)
+    if led_output is not None:
+        led_output.publish(frame)
+    
+    # Manda el estado a los espectadores (el envio corre en el hilo del servidor)
+    if spectator_server is not None:
+        spectator_server.publish(session, frame)
 
     # Recorre todas las 64 casillas del tablero
     for r in range(8):
@@ -157,27 +418,38 @@ def update_ui(window):
             sq_idx = chess.square(f, r)
             
             # Obtiene la pieza que esta en esta casilla
-            piece = board.piece_at(sq_idx)
+            piece = session.board.piece_at(sq_idx)
             
             # Selecciona la imagen correcta (pieza o casilla vacia)
-            if piece:
-                img = os.path.join(IMG_PATH, PIECE_IMAGES[piece.symbol()])
-            else:
-                img = os.path.join(IMG_PATH, 'blank.png')
+            img = piece.symbol() if piece else '.'
             
             # Calcula el color de fondo de esta casilla
-            current_bg = get_sq_color(sq_idx)
+            current_bg = frame[sq_idx]
             
-            # Actualiza el boton con la imagen y color
-            window[(r, f)].update(image_filename=img, button_color=('white', current_bg))
+            # Si la casilla se ve igual que antes no la toca
+            if drawn_squares.get((r, f)) == (img, current_bg):
+                continue
             
-            # Configura el color cuando el mouse pasa sobre la casilla
-            window[(r, f)].Widget.config(activebackground=current_bg)
+            # Solo cambia la imagen si cambio la pieza (usa la imagen en memoria)
+            previous = drawn_squares.get((r, f))
+            if board_canvas is not None:
+                # En el lienzo se recolorean los items de la casilla
+                board_canvas.paint((r, f), img, current_bg, previous)
+            else:
+                if previous is None or previous[0] != img:
+                    set_square_image(window[(r, f)], img)
+                window[(r, f)].update(button_color=('white', current_bg))
+                
+                # Configura el color cuando el mouse pasa sobre la casilla
+                window[(r, f)].Widget.config(activebackground=current_bg)
+            
+            # Recuerda lo que se dibujo
+            drawn_squares[(r, f)] = (img, current_bg)
     
     # Actualiza los indicadores de turno (circulos de colores)
     # El circulo brilla en cyan cuando es su turno
-    window['-IND-P1-'].update(text_color="#00FFFF" if board.turn == chess.WHITE else "#333333")
-    window['-IND-P2-'].update(text_color="#00FFFF" if board.turn == chess.BLACK else "#333333")
+    update_control(window, '-IND-P1-', text_color="#00FFFF" if session.board.turn == chess.WHITE else "#333333")
+    update_control(window, '-IND-P2-', text_color="#00FFFF" if session.board.turn == chess.BLACK else "#333333")
     
     # Actualiza los botones que necesitan confirmacion
     for key, text in [('RESTART', 'REINICIAR'), ('EXIT', 'SALIR')]:
@@ -186,36 +458,53 @@ def update_ui(window):
         # Cambia a rojo si espera confirmacion
         color = "#FF5252" if is_confirm else ('#444444' if key == 'EXIT' else '#2c3e50')
         # Cambia el texto a SEGURO si espera confirmacion
-        window[key].update("¿SEGURO?" if is_confirm else text, button_color=('white', color))
+        update_control(window, key, text="¿SEGURO?" if is_confirm else text, button_color=('white', color))
     
     # Actualiza el boton de modo (vs jugador o vs bot)
     is_confirm_bot = '-TOGGLE-BOT-' in confirm_states
     color_bot = "#FF5252" if is_confirm_bot else '#2c3e50'
-    text_bot = "¿SEGURO?" if is_confirm_bot else ("vs BOT" if is_bot_enabled else "vs JUGADOR")
-    window['-TOGGLE-BOT-'].update(text_bot, button_color=('white', color_bot))
+    text_bot = "¿SEGURO?" if is_confirm_bot else ("vs BOT" if session.is_bot_enabled else "vs JUGADOR")
+    update_control(window, '-TOGGLE-BOT-', text=text_bot, button_color=('white', color_bot))
     
     # Actualiza el boton del asistente
-    window['-ASISTENTE-'].update(
-        "ASISTENTE: ON" if is_assistant_enabled else "ASISTENTE: OFF",
-        button_color=('white', '#2E7D32' if is_assistant_enabled else '#2c3e50')
+    update_control(window, '-ASISTENTE-',
+        text="ASISTENTE: ON" if session.is_assistant_enabled else "ASISTENTE: OFF",
+        button_color=('white', '#2E7D32' if session.is_assistant_enabled else '#2c3e50')
     )
     
+    # Actualiza el texto del analisis continuo (vacio si no hay)
+    update_control(window, '-ANALYSIS-', value=format_analysis())
+    
+    # Estado del motor mientras arranca (buscando, descargando, iniciando)
+    update_control(window, '-STATUS-', value=engine_status)
+    
+    # Muestra u oculta las mediciones
+    update_control(window, '-METRICS-TEXT-', value=format_metrics() if is_metrics_visible else '', visible=is_metrics_visible)
+    update_control(window, '-METRICS-', button_color=('white', '#2E7D32' if is_metrics_visible else '#2c3e50'))
+    
     # Actualiza el boton de saltar turno
     # Se deshabilita en modo bot para evitar confusion
-    window['-SKIP-'].update(
-        disabled=is_bot_enabled, 
-        button_color=('white', '#555555' if is_bot_enabled else '#2c3e50')
+    update_control(window, '-SKIP-',
+        disabled=session.is_bot_enabled, 
+        button_color=('white', '#555555' if session.is_bot_enabled else '#2c3e50')
     )
 
+    # Tiempo de dibujo (sin contar el mensaje de fin de juego que espera al jugador)
+    metrics.record("ui_render", time.perf_counter() - start, full=full)
+
     # Verifica si el juego termino y aun no se mostro el mensaje
-    if board.is_game_over() and not game_over_notified:
+    info = session.board.info()
+    if info.is_game_over and not session.game_over_notified:
         # Marca que ya se mostro para no repetir
-        game_over_notified = True
+        session.game_over_notified = True
+        # Guarda la partida terminada antes de esperar al jugador
+        if PGN_EXPORT_FILE:
+            export_pgn(session, PGN_EXPORT_FILE, p2_label)
         # Refresca la pantalla antes de mostrar popup
         window.refresh()
         
         # Obtiene el resultado del juego
-        outcome = board.outcome()
+        outcome = info.outcome
         
         # Determina el mensaje segun quien gano
         if outcome.winner == chess.WHITE: 
@@ -228,32 +517,2242 @@ def update_ui(window):
         # Muestra ventana emergente con el resultado
         sg.popup(f"¡FIN DEL JUEGO!\n\n{res}", title="Resultado", font=('Helvetica', 12, 'bold'), keep_on_top=True)
 
-def engine_thread_func(current_board, q):
-    # Funcion que se ejecuta en un hilo separado
-    # Calcula el mejor movimiento sin congelar la interfaz
+# Colores "#RRGGBB" ya convertidos a 3 bytes para los LEDs
+rgb_bytes = {}
+
+def color_rgb(color):
+    # Convierte un color "#RRGGBB" a 3 bytes (se calcula una sola vez por color)
+    value = rgb_bytes.get(color)
+    if value is None:
+        value = rgb_bytes[color] = bytes.fromhex(color.lstrip("#"))
+    return value
+
+def frame_to_rgb(frame):
+    # Cuadro de 64 colores -> 192 bytes RGB seguidos (casilla 0 = a1)
+    return b"".join(color_rgb(color) for color in frame)
+
+def diff_frames(previous, current):
+    # Lista de (casilla, bytes RGB) de las casillas que cambiaron entre dos cuadros
+    # Sin cuadro anterior devuelve las 64
+    changes = []
+    for sq in range(64):
+        pixel = current[sq * 3:sq * 3 + 3]
+        if previous is None or previous[sq * 3:sq * 3 + 3] != pixel:
+            changes.append((sq, pixel))
+    return changes
+
+class LedSink:
+    # Destino de los LEDs: recibe solo las casillas que cambiaron y el cuadro
+    # completo de 192 bytes RGB. Un controlador nuevo (por ejemplo una tira
+    # WS2812 con su libreria) solo tiene que implementar write y close
+    
+    def write(self, changes, frame):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class DeviceLedSink(LedSink):
+    # Manda los cambios a un dispositivo serie o SPI (/dev/ttyUSB0, /dev/spidev0.0)
+    # Paquete: 0xA5, cantidad de casillas, y por cada una casilla, R, G, B
+    # La velocidad del puerto se configura en el sistema (por ejemplo con stty)
+    HEADER = 0xA5
+    
+    def __init__(self, path):
+        self.path = path
+        self.device = open(path, "wb", buffering=0)
+
+    def write(self, changes, frame):
+        packet = bytearray((self.HEADER, len(changes)))
+        for sq, pixel in changes:
+            packet.append(sq)
+            packet += pixel
+        self.device.write(packet)
+
+    def close(self):
+        self.device.close()
+
+class FileLedSink(LedSink):
+    # Escribe cada actualizacion como una linea JSON: {"ts": ..., "changes": [[casilla, "#rrggbb"], ...]}
+    # Sirve para depurar o para otro programa que lea de una tuberia (mkfifo)
+    
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def write(self, changes, frame):
+        line = {"ts": round(time.time(), 3), "changes": [[sq, "#" + pixel.hex()] for sq, pixel in changes]}
+        self.file.write(json.dumps(line) + "\n")
+
+    def close(self):
+        self.file.close()
+
+class MemoryLedSink(LedSink):
+    # Guarda en memoria el cuadro actual y cada actualizacion (para pruebas)
+    
+    def __init__(self):
+        self.frame = bytearray(64 * 3)
+        self.updates = []
+
+    def write(self, changes, frame):
+        for sq, pixel in changes:
+            self.frame[sq * 3:sq * 3 + 3] = pixel
+        self.updates.append(changes)
+
+def make_led_sink(config):
+    # Crea un destino de LEDs a partir de su configuracion en kchess.json
+    kind = config.get("type")
+    if kind == "device":
+        return DeviceLedSink(config["path"])
+    if kind == "file":
+        return FileLedSink(config["path"])
+    if kind == "memory":
+        return MemoryLedSink()
+    raise ValueError(f"tipo de LED desconocido: {kind}")
+
+class LedOutput:
+    # Manda los colores del tablero a los LEDs en un hilo propio
+    # La ventana solo deja el ultimo cuadro (publish no espera nunca);
+    # el hilo lo convierte a RGB, lo compara con el ultimo enviado y manda
+    # solo las casillas que cambiaron, como maximo max_fps veces por segundo
+    
+    def __init__(self, sinks, max_fps=LED_MAX_FPS):
+        self.sinks = list(sinks)
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        # Ultimo cuadro publicado por la ventana y todavia no enviado
+        self.pending = None
+        # Ultimo cuadro publicado (para no despertar al hilo si no cambio)
+        self.published = None
+        # Ultimo cuadro enviado a los LEDs en bytes RGB
+        self.sent = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def publish(self, frame):
+        # Se llama desde la ventana con el cuadro de compute_frame
+        # compute_frame devuelve la misma tupla mientras nada cambie
+        if frame is self.published:
+            return
+        with self.lock:
+            self.published = frame
+            self.pending = frame
+        self.wake.set()
+
+    def _run(self):
+        last_write = 0.0
+        while True:
+            self.wake.wait()
+            # Respeta el limite de actualizaciones; lo que llegue mientras se espera
+            # reemplaza al cuadro pendiente
+            delay = last_write + self.interval - time.monotonic()
+            if delay > 0 and not self.closed:
+                time.sleep(delay)
+            with self.lock:
+                self.wake.clear()
+                frame = self.pending
+                self.pending = None
+            if frame is not None:
+                last_write = time.monotonic()
+                self._send(frame)
+            if self.closed:
+                return
+
+    def _send(self, frame):
+        start = time.perf_counter()
+        rgb = frame_to_rgb(frame)
+        changes = diff_frames(self.sent, rgb)
+        if not changes:
+            return
+        self.sent = rgb
+        for sink in list(self.sinks):
+            try:
+                sink.write(changes, rgb)
+            except Exception as e:
+                # Un LED desconectado no debe afectar al juego: se deja de usar
+                print(f"[LED] {type(sink).__name__}: {e}")
+                metrics.event("led_error", sink=type(sink).__name__, error=repr(e))
+                self.sinks.remove(sink)
+        metrics.record("led_write", time.perf_counter() - start, pixels=len(changes))
+
+    def close(self):
+        # Manda el ultimo cuadro pendiente y cierra los destinos
+        self.closed = True
+        self.wake.set()
+        self.thread.join(timeout=1)
+        for sink in self.sinks:
+            try:
+                sink.close()
+            except Exception as e:
+                print(f"[LED] {e}")
+
+def open_led_output():
+    # Crea la salida de LEDs con los destinos de kchess.json (None si no hay)
+    config = load_config()
+    sinks = []
+    for sink_config in config.get("leds", LED_SINKS):
+        try:
+            sinks.append(make_led_sink(sink_config))
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[LED] No se pudo abrir {sink_config}: {e}")
+    if not sinks:
+        return None
+    return LedOutput(sinks, config.get("led_fps", LED_MAX_FPS))
+
+def percentile(values, fraction):
+    # Percentil por el metodo del rango mas cercano (values ya ordenada)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+def process_usage(pid):
+    # Devuelve (segundos de CPU, MB de memoria) de un proceso (None si no se puede saber)
+    # Lee /proc, asi que solo funciona en Linux (incluida la Raspberry Pi)
+    try:
+        with open(f"/proc/{pid}/stat", "r") as f:
+            # Los campos despues del nombre del proceso: utime y stime son el 12 y 13
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        rss = 0
+        with open(f"/proc/{pid}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) // 1024
+        return cpu, rss
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+class Metrics:
+    # Mediciones del programa para diagnosticar demoras sin un perfilador
+    # Guarda las ultimas duraciones de cada tipo (arranque del motor, espera en
+    # la cola, busqueda, dibujo) y escribe cada evento como una linea JSON
+    # Se puede usar desde cualquier hilo: record y event solo guardan en memoria
+    # y el hilo de mediciones escribe las lineas juntas cada METRICS_FLUSH_INTERVAL
+    
+    def __init__(self, size=METRICS_SAMPLES):
+        self.lock = threading.Lock()
+        self.size = size
+        # Nombre -> ultimas duraciones en milisegundos
+        self.samples = {}
+        # Nombre -> cantidad total de eventos
+        self.counts = {}
+        # Ultima muestra de hilos y procesos del motor
+        self.resources = {}
+        # CPU usada por cada motor en la muestra anterior: pid -> (segundos, momento)
+        self.cpu_prev = {}
+        self.log = None
+        self.log_path = None
+        # Lineas que todavia no se escribieron en el registro
+        self.pending = deque(maxlen=METRICS_PENDING_MAX)
+        self.stop = threading.Event()
+        self.thread = None
+        self.server = None
+        self.started = time.monotonic()
+
+    def open_log(self, path):
+        # Abre el registro JSON; si ya es muy grande lo rota antes
+        if not path:
+            return
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            if os.path.exists(path) and os.path.getsize(path) > METRICS_LOG_MAX_BYTES:
+                os.replace(path, path + ".1")
+            self.log = open(path, "a", encoding="utf-8")
+            self.log_path = path
+        except OSError as e:
+            print(f"[Metricas] No se pudo abrir {path}: {e}")
+
+    def _write(self, data):
+        # Deja una linea para el hilo de mediciones (se llama con el candado tomado)
+        if self.log is not None:
+            self.pending.append(data)
+
+    def flush(self):
+        # Escribe todas las lineas pendientes en una sola escritura
+        # Solo la llama el hilo de mediciones (y close cuando ese hilo ya termino)
+        with self.lock:
+            if not self.pending or self.log is None:
+                return
+            lines = list(self.pending)
+            self.pending.clear()
+            log = self.log
+        try:
+            log.write("".join(json.dumps(data) + "\n" for data in lines))
+            log.flush()
+            if log.tell() > METRICS_LOG_MAX_BYTES:
+                log.close()
+                os.replace(self.log_path, self.log_path + ".1")
+                with self.lock:
+                    self.log = open(self.log_path, "a", encoding="utf-8")
+        except OSError as e:
+            # Sin disco no se registra mas, pero el juego sigue
+            print(f"[Metricas] No se pudo escribir {self.log_path}: {e}")
+            with self.lock:
+                self.log = None
+                self.pending.clear()
+
+    def record(self, name, seconds, **fields):
+        # Guarda una duracion (en segundos) con datos extra para el registro
+        ms = seconds * 1000
+        with self.lock:
+            values = self.samples.get(name)
+            if values is None:
+                values = self.samples[name] = deque(maxlen=self.size)
+            values.append(ms)
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self._write({"ts": round(time.time(), 3), "event": name, "ms": round(ms, 2), **fields})
+
+    def event(self, name, **fields):
+        # Guarda un evento sin duracion (errores, reinicios del motor)
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self._write({"ts": round(time.time(), 3), "event": name, **fields})
+
+    def sample_resources(self):
+        # Mide los hilos vivos y la CPU y memoria de cada proceso del motor
+        now = time.monotonic()
+        service = engine_service
+        engines = []
+        for transport, _ in list(service.engines) if service else []:
+            pid = transport.get_pid()
+            usage = process_usage(pid)
+            if usage is None:
+                engines.append({"pid": pid})
+                continue
+            cpu, rss = usage
+            # Porcentaje de CPU desde la muestra anterior
+            previous = self.cpu_prev.get(pid)
+            percent = None
+            if previous and now > previous[1]:
+                percent = round((cpu - previous[0]) / (now - previous[1]) * 100, 1)
+            self.cpu_prev[pid] = (cpu, now)
+            engines.append({"pid": pid, "cpu_s": round(cpu, 2), "cpu_pct": percent, "rss_mb": rss})
+        resources = {"threads": threading.active_count(), "engines": engines}
+        with self.lock:
+            self.resources = resources
+            self._write({"ts": round(time.time(), 3), "event": "resources", **resources})
+        return resources
+
+    def summary(self):
+        # Resumen actual: por tipo cantidad, ultima, promedio, p90 y maximo (ms)
+        with self.lock:
+            timings = {}
+            for name, values in self.samples.items():
+                ordered = sorted(values)
+                timings[name] = {
+                    "count": self.counts[name],
+                    "last": round(values[-1], 2),
+                    "avg": round(sum(ordered) / len(ordered), 2),
+                    "p90": round(percentile(ordered, 0.90), 2),
+                    "max": round(ordered[-1], 2),
+                }
+            events = {name: count for name, count in self.counts.items() if name not in self.samples}
+            return {
+                "uptime": round(time.monotonic() - self.started, 1),
+                "timings": timings,
+                "events": events,
+                "resources": self.resources,
+            }
+
+    def write_status(self, path):
+        # Reescribe el archivo de estado sin dejarlo a medias
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(self.summary(), f, indent=2)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"[Metricas] No se pudo guardar {path}: {e}")
+
+    def _report(self, status_path):
+        # Hilo de fondo: escribe el registro cada METRICS_FLUSH_INTERVAL segundos
+        # y toma una muestra de recursos cada METRICS_INTERVAL segundos
+        next_sample = time.monotonic() + METRICS_INTERVAL
+        while not self.stop.wait(METRICS_FLUSH_INTERVAL):
+            if time.monotonic() >= next_sample:
+                next_sample += METRICS_INTERVAL
+                self.sample_resources()
+                if status_path:
+                    self.write_status(status_path)
+            self.flush()
+
+    def start(self, status_path=None, port=None):
+        # Arranca las muestras periodicas y, si se pide, el puerto HTTP local
+        self.thread = threading.Thread(target=self._report, args=(status_path,), daemon=True)
+        self.thread.start()
+        if port:
+            self.serve(int(port))
+
+    def serve(self, port):
+        # Sirve el resumen en http://127.0.0.1:<port>/ como JSON
+        import http.server
+        metrics_ref = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(metrics_ref.summary()).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                # Sin mensajes por cada consulta en la terminal
+                pass
+
+        try:
+            self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        except OSError as e:
+            print(f"[Metricas] No se pudo abrir el puerto {port}: {e}")
+            return
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Metricas en http://127.0.0.1:{port}/")
+
+    def close(self):
+        # Detiene las muestras y el puerto, escribe lo pendiente y cierra el registro
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+        self.flush()
+        with self.lock:
+            if self.log is not None:
+                self.log.close()
+                self.log = None
+
+# Mediciones de todo el programa (main abre el registro y el puerto si estan configurados)
+metrics = Metrics()
+
+class FairTurns:
+    # Reparte los motores del servicio entre varias partidas por turnos
+    # Cuando un motor se libera lo recibe la siguiente partida en la ronda,
+    # asi una partida con muchos pedidos no deja esperando a las demas
+    # Solo se usa dentro del bucle de fondo del servicio
+    
+    def __init__(self, size):
+        # Motores sin usar
+        self.free = size
+        # Partidas esperando, en orden de ronda: duenio -> futures de sus pedidos
+        self.waiting = OrderedDict()
+
+    async def acquire(self, owner):
+        # Espera un turno para usar un motor (owner identifica a la partida)
+        if self.free and not self.waiting:
+            self.free -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiting.setdefault(owner, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Si ya le habian dado el turno lo pasa al siguiente
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        # Devuelve un turno: pasa a la primera partida que espera y la manda al final
+        while self.waiting:
+            owner, futures = next(iter(self.waiting.items()))
+            future = futures.popleft()
+            if futures:
+                self.waiting.move_to_end(owner)
+            else:
+                del self.waiting[owner]
+            # Los pedidos cancelados mientras esperaban se saltean
+            if not future.done():
+                future.set_result(None)
+                return
+        self.free += 1
+
+class EngineService:
+    # Capa del motor sobre la API asyncio de python-chess
+    # Un solo bucle de eventos en un hilo de fondo maneja todos los procesos
+    # del motor: jugadas del bot, analisis del asistente y cancelaciones
+    # Asi no se crea un hilo ni un bucle de eventos nuevo por cada pedido
+    
+    def __init__(self, path, size=ENGINE_POOL_SIZE, options=None):
+        # Ruta al ejecutable del motor
+        self.path = path
+        # Cantidad de procesos que se abren
+        self.size = max(1, size)
+        # Opciones UCI que se configuran en cada proceso (Threads, Hash, ...)
+        self.options = options or {}
+        # Bucle de eventos propio que corre en un hilo de fondo
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        # Cola con los motores libres: pares (transporte, protocolo UCI)
+        # Los pedidos esperan aqui su turno sin ocupar ningun hilo
+        self.idle = None
+        # Lista con todos los motores abiertos para poder cerrarlos al salir
+        self.engines = []
+        # Turnos para usar los motores, repartidos entre las partidas que comparten el servicio
+        self.turns = FairTurns(self.size)
+        # Indica si el servicio ya fue cerrado
+        self.closed = False
+
+    def run(self, coro):
+        # Puente seguro entre hilos: ejecuta una corrutina en el bucle de fondo
+        # Devuelve un Future que se puede esperar o cancelar desde cualquier hilo
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def start(self):
+        # Arranca el bucle de fondo y abre todos los procesos del motor de una vez
+        self.thread.start()
+        try:
+            self.run(self._start()).result()
+        except Exception:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            raise
+
+    async def _start(self):
+        self.idle = asyncio.Queue()
+        for _ in range(self.size):
+            self.idle.put_nowait(await self._spawn())
+
+    async def _spawn(self):
+        # Abre un proceso nuevo del motor y hace el saludo UCI
+        start = time.perf_counter()
+        transport, engine = await chess.engine.popen_uci(self.path)
+        # Configura solo las opciones que este motor conoce
+        supported = {name: value for name, value in self.options.items() if name in engine.options}
+        if supported:
+            await engine.configure(supported)
+        metrics.record("engine_spawn", time.perf_counter() - start, pid=transport.get_pid())
+        entry = (transport, engine)
+        self.engines.append(entry)
+        return entry
+
+    async def _discard(self, entry):
+        # Cierra un motor que dejo de responder y lo saca de la lista
+        if entry in self.engines:
+            self.engines.remove(entry)
+        transport, engine = entry
+        try:
+            await asyncio.wait_for(engine.quit(), ENGINE_PING_TIMEOUT)
+        except Exception:
+            pass
+        transport.close()
+
+    async def _is_alive(self, engine):
+        # Chequeo de salud: manda isready y espera readyok con tiempo limite
+        try:
+            await asyncio.wait_for(engine.ping(), ENGINE_PING_TIMEOUT)
+            return True
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+            return False
+
+    async def _checked(self, entry):
+        # Chequeo de salud; si el proceso murio lo reemplaza por uno nuevo
+        if await self._is_alive(entry[1]):
+            return entry
+        print("[Engine] Motor sin respuesta, reiniciando...")
+        metrics.event("engine_restart", reason="ping", pid=entry[0].get_pid())
+        await self._discard(entry)
+        return await self._spawn()
+
+    def _put_back(self, task, entry):
+        # Devuelve a la cola el motor de un chequeo cuyo pedido se cancelo
+        ok = not task.cancelled() and task.exception() is None
+        self.idle.put_nowait(task.result() if ok else entry)
+
+    async def acquire(self):
+        # Toma un motor libre (espera si todos estan ocupados)
+        entry = await self.idle.get()
+        # El chequeo corre aparte para que una cancelacion no pierda el motor
+        check = asyncio.ensure_future(self._checked(entry))
+        try:
+            return await asyncio.shield(check)
+        except asyncio.CancelledError:
+            # El pedido se cancelo: el motor vuelve a la cola al terminar el chequeo
+            check.add_done_callback(lambda task: self._put_back(task, entry))
+            raise
+        except Exception:
+            # Si no se pudo abrir uno nuevo devuelve el lugar para no perderlo
+            self.idle.put_nowait(entry)
+            raise
+
+    async def release(self, entry, healthy=True):
+        # Devuelve el motor a la cola de libres
+        # Si quedo colgado o murio lo cambia por uno nuevo
+        if self.closed:
+            await self._discard(entry)
+            return
+        if not healthy:
+            print("[Engine] El motor no responde, reiniciando...")
+            metrics.event("engine_restart", reason="search", pid=entry[0].get_pid())
+            await self._discard(entry)
+            try:
+                entry = await self._spawn()
+            except Exception as e:
+                # Deja el lugar; acquire lo volvera a intentar
+                print(f"[Engine Error] {e}")
+        self.idle.put_nowait(entry)
+
+    async def _stop_search(self, search):
+        # Detiene una busqueda y espera su bestmove para dejar el motor libre
+        # Devuelve False si el motor no contesta a tiempo
+        try:
+            search.stop()
+            await asyncio.wait_for(asyncio.shield(search.wait()), ENGINE_TIMEOUT)
+            return True
+        except (chess.engine.EngineError, chess.engine.EngineTerminatedError, asyncio.TimeoutError):
+            return False
+
+    @staticmethod
+    def _waiter(search):
+        # Tarea que espera el final de la busqueda
+        # Si el motor se colgo el error llega despues; se lee para que no quede suelto
+        waiter = asyncio.ensure_future(search.wait())
+        waiter.add_done_callback(lambda future: future.cancelled() or future.exception())
+        return waiter
+
+    async def _start_search(self, engine, board, limit, **kwargs):
+        # Empieza una busqueda sin que una cancelacion deje el protocolo a medias
+        start = asyncio.ensure_future(engine.analysis(board, limit, **kwargs))
+        try:
+            return await asyncio.shield(start)
+        except asyncio.CancelledError:
+            # Espera a que empiece para poder detenerla y dejar el motor libre
+            search = await start
+            await self._stop_search(search)
+            raise
+
+    @staticmethod
+    def search_timeout(limit):
+        # Tiempo maximo de una busqueda antes de dar el motor por colgado
+        # Con tiempo en el limite es ese tiempo mas ENGINE_TIMEOUT; por profundidad
+        # o nodos es ENGINE_SEARCH_TIMEOUT; sin limite (se detiene al cancelar) no hay
+        if limit is None:
+            return None
+        if limit.time:
+            return limit.time + ENGINE_TIMEOUT
+        if limit.depth or limit.nodes:
+            return ENGINE_SEARCH_TIMEOUT
+        return None
+
+    async def _play_once(self, board, limit, job):
+        entry = await self.acquire()
+        # Tiempo desde el pedido hasta tener un motor libre
+        metrics.record("queue_wait", time.monotonic() - job.started, kind=job.kind)
+        search = None
+        healthy = True
+        try:
+            start = time.perf_counter()
+            search = await self._start_search(entry[1], board, limit)
+            # Registra la busqueda en el trabajo para poder terminarla antes
+            job.attach(search)
+            # Tiempo limite: si el motor se cuelga no se espera para siempre
+            timeout = self.search_timeout(limit)
+            # shield evita que una cancelacion rompa el estado interno de la busqueda
+            best = await asyncio.wait_for(asyncio.shield(self._waiter(search)), timeout)
+            metrics.record("engine_search", time.perf_counter() - start, kind=job.kind,
+                           depth=search.info.get("depth"), nodes=search.info.get("nodes"))
+            # Devuelve la jugada junto con la ultima info (puntaje, profundidad)
+            return chess.engine.PlayResult(best.move, best.ponder, search.info)
+        except (chess.engine.EngineTerminatedError, asyncio.TimeoutError) as e:
+            healthy = False
+            metrics.event("engine_error", kind=job.kind, error=type(e).__name__, pid=entry[0].get_pid())
+            raise
+        finally:
+            job.attach(None)
+            # Si se cancelo a mitad de busqueda la detiene antes de devolver el motor
+            if healthy and search is not None:
+                healthy = await self._stop_search(search)
+            await self.release(entry, healthy)
+
+    async def play(self, board, limit, job):
+        # Pide la mejor jugada a un motor del servicio
+        # Si el proceso muere durante la busqueda lo reinicia y reintenta una vez
+        for attempt in range(2):
+            try:
+                return await self._play_once(board, limit, job)
+            except chess.engine.EngineTerminatedError:
+                if attempt:
+                    raise
+                print("[Engine] El motor se cerro durante la busqueda, reintentando...")
+
+    async def stream(self, board, limit, multipv, job, publish):
+        # Analiza la posicion con varias lineas (MultiPV) y llama a publish
+        # con las lineas cada vez que mejoran (como maximo cada ANALYSIS_UPDATE_INTERVAL)
+        # Termina al llegar al limite o cuando se cancela el trabajo
+        entry = await self.acquire()
+        metrics.record("queue_wait", time.monotonic() - job.started, kind=job.kind)
+        search = None
+        healthy = True
+        try:
+            start = time.perf_counter()
+            search = await self._start_search(entry[1], board, limit, multipv=multipv)
+            job.attach(search)
+            lines = {}
+            
+            async def read_lines():
+                last_publish = 0.0
+                async for info in search:
+                    # Solo interesan los mensajes con una linea completa
+                    if "pv" not in info or "score" not in info:
+                        continue
+                    lines[info.get("multipv", 1)] = {
+                        "pv": info["pv"],
+                        "score": info["score"],
+                        "depth": info.get("depth"),
+                        "nps": info.get("nps"),
+                    }
+                    # Limita la cantidad de actualizaciones para no saturar la ventana
+                    now = time.monotonic()
+                    if 1 in lines and now - last_publish >= ANALYSIS_UPDATE_INTERVAL:
+                        last_publish = now
+                        publish([lines[k] for k in sorted(lines)])
+            
+            # Tiempo limite igual que en una jugada: si el motor se cuelga no se espera para siempre
+            await asyncio.wait_for(read_lines(), self.search_timeout(limit))
+            # Manda la version final de las lineas
+            if 1 in lines:
+                publish([lines[k] for k in sorted(lines)])
+            metrics.record("engine_search", time.perf_counter() - start, kind=job.kind,
+                           depth=lines[1]["depth"] if 1 in lines else None)
+        except (chess.engine.EngineTerminatedError, asyncio.TimeoutError) as e:
+            healthy = False
+            metrics.event("engine_error", kind=job.kind, error=type(e).__name__, pid=entry[0].get_pid())
+            if search is not None:
+                self._waiter(search)
+            raise
+        finally:
+            job.attach(None)
+            if healthy and search is not None:
+                healthy = await self._stop_search(search)
+            await self.release(entry, healthy)
+
+    async def _close(self):
+        self.closed = True
+        for entry in list(self.engines):
+            await self._discard(entry)
+
+    def close(self):
+        # Cierra todos los procesos del motor y detiene el bucle de fondo
+        try:
+            self.run(self._close()).result(timeout=ENGINE_TIMEOUT)
+        except Exception as e:
+            print(f"[Engine Error] {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=ENGINE_TIMEOUT)
+
+class AnalysisCache:
+    # Cache LRU de resultados del motor
+    # La clave es el hash Zobrist de la posicion mas el limite de busqueda
+    # Asi una posicion ya analizada (inicio, aperturas) responde al instante
+    
+    def __init__(self, max_entries=ANALYSIS_CACHE_SIZE):
+        self.max_entries = max_entries
+        # Clave -> datos del resultado; el orden indica el uso mas reciente
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(current_board, limit):
+        # Arma la clave como texto para poder guardarla en JSON
+        zobrist = chess.polyglot.zobrist_hash(current_board)
+        return f"{zobrist:016x}:{limit.time}:{limit.depth}:{limit.nodes}"
+
+    def get_entry(self, current_board, limit):
+        # Busca un resultado guardado completo (jugada, puntaje, profundidad)
+        # Devuelve None si no existe o si la jugada no es legal aqui
+        key = self.key(current_board, limit)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            # Marca la entrada como usada recientemente
+            self.entries.move_to_end(key)
+        # Por seguridad descarta resultados que no sean legales aqui
+        if not current_board.is_legal(chess.Move.from_uci(entry["move"])):
+            return None
+        return entry
+
+    def get(self, current_board, limit):
+        # Busca la jugada guardada; devuelve None si no existe
+        entry = self.get_entry(current_board, limit)
+        return chess.Move.from_uci(entry["move"]) if entry else None
+
+    def put(self, current_board, limit, result):
+        # Guarda la jugada, el puntaje y la profundidad de una busqueda
+        self.put_line(current_board, limit, result.move, result.info.get("score"), result.info.get("depth"))
+
+    def put_line(self, current_board, limit, move, score, depth, deeper_only=False):
+        # Guarda una jugada con su puntaje (por ejemplo la mejor linea del analisis)
+        # Con deeper_only no reemplaza un resultado guardado mas profundo
+        entry = {
+            "move": move.uci(),
+            "cp": score.white().score() if score else None,
+            "mate": score.white().mate() if score else None,
+            "depth": depth,
+            "limit": [limit.time, limit.depth, limit.nodes],
+        }
+        key = self.key(current_board, limit)
+        with self.lock:
+            old = self.entries.get(key)
+            if deeper_only and old is not None and (old["depth"] or 0) > (depth or 0):
+                return
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            # Si se pasa del tamano borra las menos usadas
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def load(self, path):
+        # Carga el cache guardado en una sesion anterior
+        if not path or not os.path.exists(path):
+            return
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError("no es un objeto JSON")
+            skipped = 0
+            with self.lock:
+                for key, entry in data.items():
+                    # Salta entradas cortadas o editadas a mano en vez de fallar despues
+                    if not self.valid_entry(entry):
+                        skipped += 1
+                        continue
+                    self.entries[key] = entry
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            if skipped:
+                print(f"[Cache] Se ignoraron {skipped} entradas invalidas en {path}")
+        except (OSError, ValueError) as e:
+            print(f"[Cache] No se pudo leer {path}: {e}")
+
+    @staticmethod
+    def valid_entry(entry):
+        # Indica si una entrada leida del disco tiene los datos que usa get_entry
+        if not isinstance(entry, dict) or not isinstance(entry.get("move"), str):
+            return False
+        try:
+            chess.Move.from_uci(entry["move"])
+        except ValueError:
+            return False
+        for name in ("cp", "mate", "depth"):
+            value = entry.get(name)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+                return False
+        return True
+
+    def save(self, path):
+        # Guarda el cache en disco (primero en un temporal para no dejarlo a medias)
+        if not path:
+            return
+        try:
+            with self.lock:
+                data = dict(self.entries)
+            temp_path = path + ".tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"[Cache] No se pudo guardar {path}: {e}")
+
+class PositionSnapshot:
+    # Posicion compacta e inmutable para los pedidos al motor
+    # Guarda el FEN despues de la ultima captura, jugada de peon o jugada nula
+    # y las jugadas desde ahi: son todas las posiciones que se pueden repetir,
+    # asi el motor ve las tablas por repeticion y el pedido no crece con la partida
+    # python-chess la manda como "position fen <raiz> moves <jugadas>"
+    __slots__ = ("root_fen", "moves")
+    
+    def __init__(self, root_fen, moves=()):
+        self.root_fen = root_fen
+        self.moves = tuple(moves)
+
+    def push(self, move):
+        # Devuelve la foto de la posicion despues de una jugada (no cambia esta)
+        if not move:
+            # Despues de una jugada nula la historia no se puede mandar al motor
+            board = self.board()
+            board.push(move)
+            return PositionSnapshot(board.fen())
+        return PositionSnapshot(self.root_fen, self.moves + (move,))
+
+    def board(self):
+        # Arma el tablero para el motor: la raiz mas las jugadas desde ahi
+        board = chess.Board(self.root_fen)
+        for move in self.moves:
+            board.push(move)
+        return board
+
+def take_snapshot(current_board):
+    # Foto de la posicion actual para un pedido al motor
+    # Solo mira las jugadas desde la ultima captura o jugada de peon
+    # (como mucho halfmove_clock), no todo el historial de la partida
+    count = min(current_board.halfmove_clock, len(current_board.move_stack))
+    moves = current_board.move_stack[len(current_board.move_stack) - count:]
+    # El motor no acepta jugadas nulas: la raiz queda despues de la ultima
+    for i in range(len(moves) - 1, -1, -1):
+        if not moves[i]:
+            moves = moves[i + 1:]
+            break
+    root = current_board.copy(stack=len(moves)).root() if moves else current_board
+    return PositionSnapshot(root.fen(), moves)
+
+class EngineJob:
+    # Un pedido al motor: la foto de la posicion, la cola donde va la respuesta
+    # y el numero de generacion del tablero cuando se pidio
+    # kind es "play" (una jugada), "analysis" (analisis continuo con varias lineas)
+    # o "ponder" (el bot piensa sobre la respuesta esperada del jugador)
+    
+    def __init__(self, generation, snapshot, target, kind="play", loop=None, session=None):
+        self.generation = generation
+        self.snapshot = snapshot
+        self.target = target
+        self.kind = kind
+        # Bucle de fondo del servicio del motor donde corre el pedido
+        self.loop = loop
+        # Partida que hizo el pedido (recibe el resultado en sus colas)
+        self.session = session
+        # Se activa cuando el pedido ya no sirve (el tablero cambio)
+        self.cancelled = threading.Event()
+        # Future de la tarea en el bucle de fondo (para poder cancelarla)
+        self.future = None
+        # Busqueda en curso en el motor (None si aun no empezo)
+        # Solo se usa dentro del bucle de fondo
+        self.search = None
+        self.lock = threading.Lock()
+        # Momento en que se pidio (para medir la espera por un motor)
+        self.started = time.monotonic()
+        # Momento en que el motor empezo a buscar (para saber cuanto tiempo ya penso)
+        self.search_started = None
+        # Jugada del jugador que se espera (solo para ponder)
+        self.expected = None
+        # Indica si el jugador hizo la jugada esperada (ponder acertado)
+        self.hit = False
+        # Indica que el acierto ya llego al bucle de fondo y la busqueda debe
+        # terminar al completar el limite del bot (solo en el bucle de fondo)
+        self.hit_armed = False
+        # Indica que hay que terminar la busqueda y usar su resultado
+        self.finished = False
+        # Indica que la tarea ya termino con este pedido
+        self.done = False
+
+    def attach(self, search):
+        # Guarda la busqueda en curso (se llama dentro del bucle de fondo)
+        # Si ya estaba terminado la detiene de una vez; si el ponder ya acerto
+        # mientras esperaba un motor el limite del bot empieza a contar ahora
+        self.search = search
+        if search is None:
+            return
+        self.search_started = time.monotonic()
+        if self.finished:
+            search.stop()
+        elif self.hit_armed:
+            self._check_limit()
+
+    def _finish(self):
+        # Detiene la busqueda pero conserva su resultado (dentro del bucle de fondo)
+        self.finished = True
+        if self.search is not None:
+            self.search.stop()
+
+    def ponderhit(self):
+        # El jugador hizo la jugada esperada: el bot sigue pensando solo el tiempo
+        # que le falta para completar su limite y despues juega
+        # Devuelve False si la busqueda ya habia terminado (hay que pedir otra)
+        with self.lock:
+            if self.done or self.cancelled.is_set():
+                return False
+            self.hit = True
+        # El limite se controla en el mismo bucle de fondo (sin hilos extra)
+        self.loop.call_soon_threadsafe(self._arm)
+        return True
+
+    def _arm(self):
+        # Ponder acertado (dentro del bucle de fondo): la busqueda sigue hasta
+        # completar el limite del bot; si todavia espera un motor lo hace attach
+        self.hit_armed = True
+        if self.search is not None:
+            self._check_limit()
+
+    def _check_limit(self):
+        # Termina la busqueda cuando completa el limite del bot contado desde que
+        # empezo a buscar: por tiempo con un temporizador, por profundidad o nodos
+        # mirando la info del motor cada PONDER_CHECK_INTERVAL segundos
+        if self.finished or self.search is None:
+            return
+        bot_limit = ENGINE_LIMITS["bot"]
+        if bot_limit.time:
+            remaining = bot_limit.time - (time.monotonic() - self.search_started)
+            self.loop.call_later(max(0.0, remaining), self._finish)
+            return
+        info = self.search.info
+        if bot_limit.depth and info.get("depth", 0) < bot_limit.depth:
+            self.loop.call_later(PONDER_CHECK_INTERVAL, self._check_limit)
+            return
+        if bot_limit.nodes and info.get("nodes", 0) < bot_limit.nodes:
+            self.loop.call_later(PONDER_CHECK_INTERVAL, self._check_limit)
+            return
+        self._finish()
+
+    def cancel(self):
+        # Marca el pedido como viejo y cancela su tarea
+        # La tarea detiene la busqueda en el motor antes de liberarlo
+        # Solo cancela una vez para no interrumpir esa limpieza
+        with self.lock:
+            if self.cancelled.is_set():
+                return
+            self.cancelled.set()
+            future = self.future
+        if future is not None:
+            future.cancel()
+
+class EngineScheduler:
+    # Recibe los pedidos al motor de una partida y los ejecuta como tareas del bucle de fondo
+    # Cada vez que cambia el tablero sube la generacion y cancela lo pendiente
+    # Sin servicio (motor todavia arrancando) solo cuenta las generaciones
+    
+    def __init__(self, service, max_searches=MAX_ENGINE_SEARCHES, session=None):
+        self.service = service
+        # Partida duenia de este planificador
+        self.session = session
+        # Pedidos pendientes o en curso (para poder cancelarlos)
+        self.active = set()
+        self.lock = threading.Lock()
+        # Numero de la posicion actual del tablero
+        self.generation = 0
+        # Nunca corren mas busquedas de esta partida que este numero
+        self.max_searches = max(1, max_searches)
+        # El semaforo se crea en el bucle de fondo con el primer pedido: la partida
+        # se arma en el hilo de la ventana y en Python 3.9 quedaria atado a otro bucle
+        self.slots = None
+
+    async def _run(self, job):
+        # Tarea del bucle de fondo que resuelve un pedido
+        if self.slots is None:
+            self.slots = asyncio.Semaphore(self.max_searches)
+        async with self.slots:
+            # Si el pedido quedo viejo mientras esperaba no lo calcula
+            if job.cancelled.is_set():
+                return
+            # Espera su turno en los motores compartidos con las otras partidas
+            await self.service.turns.acquire(self)
+            try:
+                if not job.cancelled.is_set():
+                    await engine_task(self.service, job)
+            finally:
+                self.service.turns.release()
+
+    def _forget(self, job):
+        # Se llama cuando la tarea termina (tambien si se cancelo antes de empezar)
+        with job.lock:
+            job.done = True
+        with self.lock:
+            self.active.discard(job)
+
+    def advance(self, keep=None):
+        # Se llama cada vez que cambia el tablero
+        # Cancela todas las busquedas de posiciones anteriores
+        # keep es un pedido que sigue valido en la posicion nueva (ponder acertado)
+        with self.lock:
+            self.generation += 1
+            jobs = list(self.active)
+            if keep is not None:
+                keep.generation = self.generation
+        for job in jobs:
+            if job is not keep:
+                job.cancel()
+        return self.generation
+
+    def submit(self, snapshot, target, kind="play"):
+        # Agrega un pedido para la posicion actual (PositionSnapshot)
+        with self.lock:
+            job = EngineJob(self.generation, snapshot, target, kind, self.service.loop, self.session)
+            self.active.add(job)
+            job.future = self.service.run(self._run(job))
+        # Fuera del candado: si la tarea ya termino el aviso corre en este hilo
+        job.future.add_done_callback(lambda future: self._forget(job))
+        return job
+
+    def cancel(self, target):
+        # Cancela solo los pedidos que van a una cola (por ejemplo el asistente)
+        with self.lock:
+            jobs = [job for job in self.active if job.target is target]
+        for job in jobs:
+            job.cancel()
+
+    def close(self):
+        # Cancela todos los pedidos pendientes
+        with self.lock:
+            jobs = list(self.active)
+        for job in jobs:
+            job.cancel()
+
+async def engine_task(service, job):
+    # Tarea que corre en el bucle de fondo del servicio del motor
+    # Calcula el mejor movimiento sin congelar la interfaz
+    if job.kind == "analysis":
+        await analysis_task(service, job)
+        return
+    try:
+        # Arma en el bucle de fondo el tablero de la foto (no en el hilo de la ventana)
+        temp_board = job.snapshot.board()
+        
+        # Le pide a un motor ya abierto que calcule el mejor movimiento
+        # El ponder piensa hasta que el jugador mueva, pero como mucho lo mismo que
+        # el analisis continuo: una partida quieta no deja el motor al 100% de CPU
+        if job.kind == "ponder":
+            limit = analysis_limit() if ANALYSIS_MAX_TIME else None
+        else:
+            limit = job.session.engine_limit(job.target)
+        result = await service.play(temp_board, limit, job)
+        
+        # Si el pedido se cancelo el resultado ya no sirve
+        if result.move is None or job.cancelled.is_set():
+            return
+        
+        if job.kind == "ponder":
+            # El resultado del ponder solo sirve si el jugador hizo la jugada esperada
+            # (con el candado: un acierto que llega despues ve done y pide otra busqueda)
+            with job.lock:
+                if not job.hit:
+                    job.done = True
+                    return
+        elif analysis_cache is not None:
+            # Guarda el resultado para no volver a analizar esta posicion
+            analysis_cache.put(temp_board, limit, result)
+        
+        # Pone el resultado junto con su generacion y la respuesta esperada en la cola
+        job.target.put((job.generation, result.move, result.ponder))
+        # Despierta a quien maneja la partida para que lo use de inmediato
+        job.session.notify()
+    except Exception as e:
+        # Si hay error lo muestra en la terminal y lo guarda en el registro
+        print(f"[Engine Error] {e}")
+        metrics.event("engine_error", kind=job.kind, error=repr(e))
+
+def analysis_limit():
+    # Limite del analisis continuo (tambien es la clave de sus resultados en el cache)
+    return chess.engine.Limit(time=ANALYSIS_MAX_TIME)
+
+def cached_analysis(current_board):
+    # Mejor linea guardada del analisis continuo como linea para la ventana
+    # Devuelve None si la posicion no se analizo antes
+    if analysis_cache is None:
+        return None
+    entry = analysis_cache.get_entry(current_board, analysis_limit())
+    if entry is None:
+        return None
+    if entry["mate"] is not None:
+        score = chess.engine.Mate(entry["mate"])
+    elif entry["cp"] is not None:
+        score = chess.engine.Cp(entry["cp"])
+    else:
+        return None
+    return {
+        "pv": [chess.Move.from_uci(entry["move"])],
+        "score": chess.engine.PovScore(score, chess.WHITE),
+        "depth": entry["depth"],
+        "nps": None,
+        "cached": True,
+    }
+
+async def analysis_task(service, job):
+    # Analisis continuo del asistente: manda las mejores lineas a la ventana
+    # a medida que el motor profundiza, hasta que el tablero cambie
+    board = job.snapshot.board()
+    last = []
+    def publish(lines):
+        last[:] = lines
+        # Solo publica si el pedido sigue siendo de la posicion actual
+        if not job.cancelled.is_set():
+            job.target.put((job.generation, lines))
+            job.session.notify()
+    try:
+        limit = analysis_limit() if ANALYSIS_MAX_TIME else None
+        await service.stream(board, limit, ANALYSIS_MULTIPV, job, publish)
+    except Exception as e:
+        # Si hay error lo muestra en la terminal y lo guarda en el registro
+        print(f"[Engine Error] {e}")
+        metrics.event("engine_error", kind=job.kind, error=repr(e))
+    finally:
+        # Guarda la mejor linea al terminar (tambien si el tablero cambio antes)
+        # para que la posicion responda al instante la proxima vez
+        if last and analysis_cache is not None:
+            best = last[0]
+            analysis_cache.put_line(board, analysis_limit(), best["pv"][0], best["score"], best["depth"], deeper_only=True)
+
+def format_analysis():
+    # Arma el texto de las lineas del analisis continuo para la ventana
+    # Ejemplo: "1) 1. e4 e5 2. Nf3  +0.35  d18  1250 kn/s"
+    generation, lines = session.analysis_lines
+    if not session.is_assistant_enabled or generation != session.scheduler.generation:
+        return ""
+    rows = []
+    for i, line in enumerate(lines, 1):
+        score = line["score"].white()
+        score_text = f"#{score.mate()}" if score.is_mate() else f"{score.score() / 100:+.2f}"
+        try:
+            # Muestra solo las primeras jugadas de cada linea
+            moves = session.board.variation_san(line["pv"][:4])
+        except ValueError:
+            continue
+        nps = f"{line['nps'] // 1000} kn/s" if line["nps"] else ""
+        rows.append(f"{i}) {moves}  {score_text}  d{line['depth']}  {nps}")
+    return "\n".join(rows)
+
+# Nombres que se muestran en pantalla para cada medicion
+METRICS_LABELS = [
+    ("engine_spawn", "arranque motor"),
+    ("queue_wait", "espera motor"),
+    ("engine_search", "busqueda"),
+    ("ui_render", "dibujo"),
+    ("led_write", "LEDs"),
+    ("spectator_broadcast", "espectadores"),
+    ("journal_sync", "registro"),
+]
+
+def format_metrics():
+    # Texto con los tiempos y recursos para mostrar debajo del tablero
+    summary = metrics.summary()
+    lines = []
+    for name, label in METRICS_LABELS:
+        t = summary["timings"].get(name)
+        if t:
+            lines.append(f"{label:<15}{t['count']:>5}  ult {t['last']:>7.1f}  p90 {t['p90']:>7.1f}  max {t['max']:>7.1f} ms")
+    resources = summary["resources"]
+    if resources:
+        engines = resources["engines"]
+        cpu = sum(e.get("cpu_pct") or 0 for e in engines)
+        rss = sum(e.get("rss_mb") or 0 for e in engines)
+        lines.append(f"hilos {resources['threads']}  motores {len(engines)}  CPU {cpu:.0f}%  memoria {rss} MB")
+    errors = summary["events"].get("engine_error", 0) + summary["events"].get("engine_restart", 0)
+    if errors:
+        lines.append(f"errores/reinicios del motor: {errors}")
+    return "\n".join(lines) or "sin mediciones todavia"
+
+def open_book_and_tablebases():
+    # Abre el libro de aperturas y las tablas de finales si existen
+    global opening_book, tablebase
+    if os.path.isfile(BOOK_PATH):
+        try:
+            opening_book = chess.polyglot.open_reader(BOOK_PATH)
+            print(f"Libro de aperturas: {BOOK_PATH}")
+        except OSError as e:
+            print(f"[Libro] No se pudo abrir {BOOK_PATH}: {e}")
+    if os.path.isdir(SYZYGY_PATH):
+        import chess.syzygy
+        try:
+            tablebase = chess.syzygy.open_tablebase(SYZYGY_PATH)
+            print(f"Tablas de finales: {SYZYGY_PATH}")
+        except OSError as e:
+            print(f"[Syzygy] No se pudo abrir {SYZYGY_PATH}: {e}")
+
+def close_book_and_tablebases():
+    # Cierra los archivos del libro y de las tablas
+    global opening_book, tablebase
+    if opening_book is not None:
+        opening_book.close()
+        opening_book = None
+    if tablebase is not None:
+        tablebase.close()
+        tablebase = None
+
+def book_move(current_board, random_pick):
+    # Busca la posicion en el libro de aperturas
+    # El bot elige al azar segun los pesos para variar; el asistente usa la mejor
+    if opening_book is None:
+        return None
+    try:
+        if random_pick:
+            return opening_book.weighted_choice(current_board).move
+        return opening_book.find(current_board).move
+    except IndexError:
+        # La posicion no esta en el libro
+        return None
+
+def tablebase_move(current_board):
+    # Elige la jugada perfecta con las tablas de finales
+    # Solo se usa con pocas piezas; si falta alguna tabla devuelve None
+    if tablebase is None or chess.popcount(current_board.occupied) > SYZYGY_MAX_PIECES:
+        return None
+    temp_board = current_board.copy(stack=False)
+    best_move, best_key = None, None
+    try:
+        for move in list(temp_board.legal_moves):
+            temp_board.push(move)
+            # Si da jaque mate no hace falta buscar mas
+            if temp_board.is_checkmate():
+                return move
+            # Resultado desde el punto de vista del que mueve ahora (2 gana, 0 tablas, -2 pierde)
+            wdl = -tablebase.probe_wdl(temp_board)
+            dtz = tablebase.probe_dtz(temp_board)
+            temp_board.pop()
+            # Primero el mejor resultado; si gana lo mas rapido, si pierde lo mas lento
+            key = (wdl, -abs(dtz) if wdl > 0 else abs(dtz))
+            if best_key is None or key > best_key:
+                best_move, best_key = move, key
+    except KeyError:
+        # Falta la tabla de esta combinacion de piezas
+        return None
+    return best_move
+
+def notify_engine_result():
+    # Avisa a la ventana que hay un resultado nuevo en las colas
+    # write_event_value es seguro de llamar desde otros hilos
+    if engine_window is not None:
+        try:
+            engine_window.write_event_value(ENGINE_EVENT, None)
+        except Exception:
+            # La ventana ya se cerro
+            pass
+
+class PositionInfo:
+    # Lo que se deriva de una posicion: jugadas legales, jaque y resultado
+    # Se calcula una sola vez por posicion; despues cada clic o dibujo es una
+    # busqueda en diccionarios en vez de volver a generar las jugadas
+    
+    def __init__(self, board):
+        # Jugadas legales por casilla: origen -> {destino: jugada}
+        # En las coronaciones queda la de reina (la que juega la ventana)
+        self.moves_from = {}
+        # Clase de cada jugada legal para los colores: "capture", "castling" o "quiet"
+        self.classes = {}
+        for move in board.generate_legal_moves():
+            if move.promotion in (None, chess.QUEEN):
+                self.moves_from.setdefault(move.from_square, {})[move.to_square] = move
+            if board.is_capture(move):
+                self.classes[move] = "capture"
+            elif board.is_castling(move):
+                self.classes[move] = "castling"
+            else:
+                self.classes[move] = "quiet"
+        self.is_check = board.is_check()
+        # Resultado si la partida termino (None si sigue)
+        self.outcome = board.outcome()
+        self.is_game_over = self.outcome is not None
+
+    def is_legal(self, move):
+        # Indica si la jugada es legal en esta posicion
+        return move in self.classes
+
+class CachedBoard(chess.Board):
+    # Tablero que guarda el PositionInfo de su posicion actual
+    # Se olvida solo cuando la posicion cambia: push, pop y todo lo que la
+    # cambia sin jugar (set_fen, reset y los demas pasan por clear_stack)
+    
+    def __init__(self, *args, **kwargs):
+        self._info = None
+        super().__init__(*args, **kwargs)
+
+    def info(self):
+        # Devuelve lo derivado de la posicion actual (lo calcula la primera vez)
+        # outcome() hace push/pop internos, por eso se guarda despues de calcularlo
+        if self._info is None:
+            self._info = PositionInfo(self)
+        return self._info
+
+    def push(self, move):
+        self._info = None
+        super().push(move)
+
+    def pop(self):
+        self._info = None
+        return super().pop()
+
+    def clear_stack(self):
+        self._info = None
+        super().clear_stack()
+
+class GameSession:
+    # Una partida: tablero, seleccion, sugerencia, modos y pedidos al motor
+    # La ventana muestra una sola (session); HeadlessDriver maneja muchas en el
+    # mismo proceso, todas con el mismo servicio de motores
+    
+    def __init__(self, service=None, notify=None, max_searches=MAX_ENGINE_SEARCHES):
+        # Objeto que representa el tablero de ajedrez con todas sus reglas
+        self.board = CachedBoard()
+        # Cola para recibir movimientos del bot (como una fila de espera)
+        self.move_queue = queue.Queue()
+        # Cola para recibir sugerencias del asistente
+        self.suggestion_queue = queue.Queue()
+        # Cola para recibir las lineas del analisis continuo del asistente
+        self.analysis_queue = queue.Queue()
+        # Ultimas lineas del analisis continuo: (generacion, lista de lineas)
+        self.analysis_lines = (None, [])
+        # Busqueda del bot sobre la respuesta esperada del jugador (ponder)
+        self.ponder_job = None
+        # Casilla que el jugador tiene seleccionada actualmente
+        self.selected_square = None
+        # Diccionario con los movimientos validos desde la casilla seleccionada
+        self.valid_moves_squares = {}
+        # Movimiento que el motor sugiere al jugador
+        self.engine_suggestion = None
+        # Indica si el modo bot esta activado (el bot juega con negras)
+        self.is_bot_enabled = False
+        # Indica si el asistente esta activado
+        self.is_assistant_enabled = False
+        # El bot piensa en el tiempo del jugador sobre la respuesta que espera
+        self.ponder = BOT_PONDER
+        # Indica si ya se mostro el mensaje de fin de juego
+        self.game_over_notified = False
+        # Posicion desde la que empezo la partida (inicio o FEN cargado)
+        self.start_fen = chess.STARTING_FEN
+        # Reloj: segundos que uso cada color y momento en que empezo el turno actual
+        self.clock = {chess.WHITE: 0.0, chess.BLACK: 0.0}
+        self.turn_started = time.monotonic()
+        # Ultimo cuadro de 64 colores calculado y el estado con el que se calculo
+        # Si el estado no cambio se reutiliza sin recalcular nada
+        self.frame_cache = {"key": None, "frame": None}
+        # Planificador propio: al cambiar este tablero solo se cancelan sus busquedas
+        self.scheduler = EngineScheduler(service, max_searches, self)
+        # Funcion que avisa que hay resultados nuevos en las colas (por defecto la ventana)
+        self.notify = notify or notify_engine_result
+        # Registro en disco de la partida (None si no se guarda)
+        self.journal = None
+
+    def reset_selection(self):
+        # Limpia todas las variables de seleccion
+        # Se usa cuando el jugador hace un movimiento o cancela
+        self.selected_square = None
+        self.valid_moves_squares = {}
+        # NO limpiamos engine_suggestion aqui para que persista
+
+    def bot_to_move(self):
+        # Indica si es el turno del bot
+        return self.is_bot_enabled and self.board.turn == chess.BLACK
+
+    def compute_frame(self):
+        # Calcula el color de las 64 casillas en una sola pasada
+        # Devuelve una tupla indexada por casilla (0 = a1, 63 = h8)
+        # Sirve para la interfaz y para modulos externos (por ejemplo LEDs)
+    
+        # Estado que decide los colores: si no cambio se devuelve el cuadro anterior
+        # (el PositionInfo cambia con la posicion, asi no hace falta armar el FEN)
+        info = self.board.info()
+        key = (info, self.selected_square, self.engine_suggestion, self.is_assistant_enabled, self.is_bot_enabled)
+        if self.frame_cache["key"] == key:
+            return self.frame_cache["frame"]
+    
+        # Empieza con los colores base y aplica las prioridades de menor a mayor
+        frame = list(BASE_FRAME)
+    
+        # Clasifica una sola vez cada movimiento de la pieza seleccionada
+        highlights = {}
+        for sq_idx, move in self.valid_moves_squares.items():
+            kind = info.classes[move]
+            # Si el movimiento captura una pieza la pinta amarilla
+            if kind == "capture":
+                highlights[sq_idx] = COLORS["CAPTURE"]
+            # Si es movimiento especial la pinta magenta
+            elif kind == "castling":
+                highlights[sq_idx] = COLORS["SPECIAL"]
+            # PRIORIDAD 4: Movimientos validos normales (verde claro u oscuro)
+            else:
+                frame[sq_idx] = COLORS["VALID_DARK"] if BASE_FRAME[sq_idx] == COLORS["DARK"] else COLORS["VALID_LIGHT"]
+    
+        # PRIORIDAD 3: Sugerencia del asistente (se verifica que sea legal una sola vez)
+        # No muestra sugerencia cuando es turno del bot
+        if (self.is_assistant_enabled and self.engine_suggestion and info.is_legal(self.engine_suggestion)
+                and not (self.is_bot_enabled and self.board.turn == chess.BLACK)):
+            # Color diferente segun quien juega
+            color = COLORS["SUGGESTED_P1"] if self.board.turn == chess.WHITE else COLORS["SUGGESTED_P2"]
+            frame[self.engine_suggestion.from_square] = color
+            frame[self.engine_suggestion.to_square] = color
+    
+        # PRIORIDAD 2: Capturas y movimientos especiales
+        for sq_idx, color in highlights.items():
+            frame[sq_idx] = color
+    
+        # PRIORIDAD 1: La casilla seleccionada siempre se ve cyan
+        if self.selected_square is not None:
+            frame[self.selected_square] = COLORS["SELECTED"]
+    
+        # Guarda el cuadro para reutilizarlo mientras el estado no cambie
+        frame = tuple(frame)
+        self.frame_cache["key"] = key
+        self.frame_cache["frame"] = frame
+        return frame
+
+    def engine_limit(self, target):
+        # Devuelve el limite de busqueda segun quien recibe la respuesta
+        return ENGINE_LIMITS["bot"] if target is self.move_queue else ENGINE_LIMITS["assistant"]
+
+    def request_engine(self, q):
+        # Si el motor todavia esta arrancando se pide al quedar listo
+        if self.scheduler.service is None:
+            return
+        # Primero consulta el libro de aperturas y las tablas de finales
+        known = book_move(self.board, random_pick=q is self.move_queue) or tablebase_move(self.board)
+        # Si la posicion ya fue analizada usa el resultado guardado al instante
+        if known is None and analysis_cache is not None:
+            known = analysis_cache.get(self.board, self.engine_limit(q))
+        if known is not None:
+            q.put((self.scheduler.generation, known, None))
+            self.notify()
+            return
+        # Si no manda una copia de la posicion actual al planificador del motor
+        self.scheduler.submit(take_snapshot(self.board), q)
+
+    def request_assistant(self):
+        # Pide al motor la sugerencia del asistente
+        # Si el motor todavia esta arrancando se pide al quedar listo
+        if self.scheduler.service is None:
+            return
+        if ASSISTANT_ANALYSIS_MODE:
+            # El libro y las tablas de finales ya dan la mejor jugada sin analizar
+            known = book_move(self.board, random_pick=False) or tablebase_move(self.board)
+            if known is not None:
+                self.suggestion_queue.put((self.scheduler.generation, known, None))
+                self.notify()
+                return
+            # Si la posicion ya se analizo muestra al instante la linea guardada
+            # mientras el motor vuelve a profundizar
+            line = cached_analysis(self.board)
+            if line is not None:
+                self.analysis_queue.put((self.scheduler.generation, [line]))
+                self.notify()
+            # Analisis continuo con varias lineas (se detiene al cambiar el tablero)
+            self.scheduler.submit(take_snapshot(self.board), self.analysis_queue, kind="analysis")
+        else:
+            # Una sola busqueda con el limite normal
+            self.request_engine(self.suggestion_queue)
+
+    def request_next(self):
+        # Pide lo que corresponde al turno: la jugada del bot o la ayuda del asistente
+        if self.board.info().is_game_over:
+            return
+        if self.bot_to_move():
+            self.request_engine(self.move_queue)
+        elif self.is_assistant_enabled:
+            self.request_assistant()
+
+    def start_ponder(self, expected):
+        # Despues de mover, el bot piensa sobre la posicion que quedaria
+        # si el jugador hace la respuesta esperada
+        self.ponder_job = None
+        if self.scheduler.service is None or expected is None or not self.board.info().is_legal(expected):
+            return
+        # Con un solo motor el ponder lo ocuparia todo el turno y el asistente
+        # del jugador no tendria donde analizar
+        if self.scheduler.service.size < 2:
+            return
+        snapshot = take_snapshot(self.board).push(expected)
+        if snapshot.board().is_game_over():
+            return
+        self.ponder_job = self.scheduler.submit(snapshot, self.move_queue, kind="ponder")
+        self.ponder_job.expected = expected
+
+    def take_ponder_hit(self, move):
+        # Devuelve la busqueda de ponder si el jugador hizo la jugada esperada
+        # Siempre olvida el ponder actual (acierte o no)
+        job, self.ponder_job = self.ponder_job, None
+        if job is not None and job.expected == move and not job.cancelled.is_set():
+            return job
+        return None
+
+    def set_position(self, fen=None):
+        # Empieza de nuevo desde la posicion inicial o desde un FEN
+        # Si el FEN es invalido lanza ValueError sin cambiar nada
+        if fen:
+            self.board.set_fen(fen)
+        else:
+            self.board.reset()
+        self.start_fen = self.board.fen()
+        self.clock = {chess.WHITE: 0.0, chess.BLACK: 0.0}
+        self.turn_started = time.monotonic()
+        # Partida nueva: el registro empieza de nuevo con este estado
+        if self.journal is not None:
+            self.journal.reset(self.journal_snapshot())
+        self.position_changed()
+
+    def set_assistant(self, enabled):
+        # Prende o apaga el asistente
+        self.is_assistant_enabled = enabled
+        self.log(f"A {int(enabled)}")
+        # Si se activo calcula primera sugerencia
+        if enabled and not self.board.info().is_game_over and not self.bot_to_move():
+            self.request_assistant()
+        else:
+            # Si se desactivo borra la sugerencia y detiene su busqueda
+            self.engine_suggestion = None
+            self.scheduler.cancel(self.suggestion_queue)
+            self.scheduler.cancel(self.analysis_queue)
+
+    def log(self, line):
+        # Anota un cambio en el registro de la partida (si hay uno abierto)
+        # Cada tanto lo reemplaza por el estado completo para que no crezca sin limite
+        if self.journal is None:
+            return
+        self.journal.append(line)
+        if self.journal.lines >= JOURNAL_COMPACT_LINES:
+            self.journal.reset(self.journal_snapshot())
+
+    def journal_snapshot(self):
+        # Linea con el estado completo: modos, posicion inicial y todas las jugadas
+        # Ejemplo: "P 1 0 rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1|e2e4 e7e5"
+        moves = " ".join(move.uci() for move in self.board.move_stack)
+        return f"P {int(self.is_bot_enabled)} {int(self.is_assistant_enabled)} {self.start_fen}|{moves}"
+
+    def replay(self, lines):
+        # Rehace la partida con las lineas del registro (al arrancar, sin pedir nada al motor)
+        # P: estado completo, M: jugada (0000 = turno saltado), A: asistente prendido o apagado
+        # Una linea cortada o que no se puede aplicar (corte de luz a mitad de escritura)
+        # termina la lectura; devuelve la cantidad de lineas usadas
+        used = 0
+        for line in lines:
+            if not line.endswith("\n"):
+                break
+            kind, _, data = line.rstrip("\n").partition(" ")
+            try:
+                if kind == "P":
+                    bot, assistant, rest = data.split(" ", 2)
+                    fen, _, moves = rest.partition("|")
+                    self.board.set_fen(fen)
+                    self.start_fen = self.board.fen()
+                    self.is_bot_enabled = bot == "1"
+                    self.is_assistant_enabled = assistant == "1"
+                    for uci in moves.split():
+                        self.board.push(self.board.parse_uci(uci))
+                elif kind == "M":
+                    self.board.push(self.board.parse_uci(data))
+                elif kind == "A":
+                    self.is_assistant_enabled = data == "1"
+                else:
+                    break
+            except ValueError:
+                break
+            used += 1
+        self.scheduler.advance()
+        self.reset_selection()
+        self.engine_suggestion = None
+        # Si la partida ya habia terminado no vuelve a mostrar el mensaje
+        self.game_over_notified = self.board.info().is_game_over
+        return used
+
+    def tick(self):
+        # Suma al reloj del color que mueve el tiempo de su turno (antes de cada jugada)
+        now = time.monotonic()
+        self.clock[self.board.turn] += now - self.turn_started
+        self.turn_started = now
+
+    def skip_turn(self):
+        # Hace un movimiento nulo (pasa el turno)
+        self.tick()
+        self.board.push(chess.Move.null())
+        self.log("M 0000")
+        self.position_changed()
+
+    def position_changed(self):
+        # El tablero cambio por algo que no es una jugada: cancela las busquedas
+        # viejas y pide lo que corresponda a la posicion nueva
+        self.scheduler.advance()
+        self.reset_selection()
+        self.game_over_notified = False
+        self.request_next()
+
+    def play_move(self, move):
+        # Ejecuta la jugada del jugador (ya verificada como legal)
+        self.tick()
+        self.board.push(move)
+        self.log(f"M {move.uci()}")
+        # Si el bot ya estaba pensando sobre esta jugada no cancela esa busqueda
+        hit_job = self.take_ponder_hit(move)
+        self.scheduler.advance(keep=hit_job)
+        self.reset_selection()
+        # Con ponder acertado el bot responde con esa busqueda
+        if self.bot_to_move() and hit_job and hit_job.ponderhit():
+            return
+        self.request_next()
+
+    def apply_engine_results(self):
+        # Usa los resultados del motor que llegaron a las colas
+        # Devuelve True si algo cambio y hay que redibujar
+        changed = False
+        
+        # Verifica si el bot termino de calcular su movimiento
+        try:
+            # Intenta obtener movimiento de la cola sin esperar
+            generation, bot_move, expected_reply = self.move_queue.get_nowait()
+            # Solo lo usa si fue calculado para la posicion actual
+            if generation == self.scheduler.generation and self.board.info().is_legal(bot_move):
+                # Ejecuta el movimiento del bot
+                self.tick()
+                self.board.push(bot_move)
+                self.log(f"M {bot_move.uci()}")
+                self.scheduler.advance()
+                # Piensa en el tiempo del jugador sobre la respuesta esperada
+                if self.ponder and not self.board.info().is_game_over:
+                    self.start_ponder(expected_reply)
+                # Borra la sugerencia anterior y si el asistente esta activo pide otra
+                self.engine_suggestion = None
+                self.request_next()
+                changed = True
+        except queue.Empty:
+            # Si no hay movimiento del bot continua
+            pass
+        
+        # Verifica si hay nueva sugerencia del asistente
+        try:
+            generation, new_sugg, _ = self.suggestion_queue.get_nowait()
+            # Verifica que sea de la posicion actual y que sea legal
+            if generation == self.scheduler.generation and self.board.info().is_legal(new_sugg):
+                self.engine_suggestion = new_sugg
+                changed = True
+        except queue.Empty:
+            pass
+        
+        # Verifica si hay lineas nuevas del analisis continuo
+        # Solo importa la mas reciente, las anteriores se descartan
+        latest = None
+        while True:
+            try:
+                latest = self.analysis_queue.get_nowait()
+            except queue.Empty:
+                break
+        if latest and latest[0] == self.scheduler.generation and self.is_assistant_enabled:
+            # La linea guardada se mantiene hasta que el motor llegue a su profundidad
+            shown = self.analysis_lines[1]
+            if (self.analysis_lines[0] == latest[0] and shown and shown[0].get("cached")
+                    and (latest[1][0]["depth"] or 0) < (shown[0]["depth"] or 0)):
+                latest = None
+        if latest and latest[0] == self.scheduler.generation and self.is_assistant_enabled:
+            self.analysis_lines = latest
+            # La primera jugada de la mejor linea es la sugerencia
+            best = latest[1][0]["pv"][0]
+            if self.board.is_legal(best):
+                self.engine_suggestion = best
+            changed = True
+        return changed
+
+    def close(self):
+        # Cancela todos los pedidos pendientes de la partida
+        self.scheduler.close()
+
+class HeadlessDriver:
+    # Varias partidas sin ventana en un solo proceso (por ejemplo los tableros de un club)
+    # Todas usan el mismo servicio de motores: la CPU queda limitada por la cantidad
+    # de motores abiertos y los turnos se reparten en ronda entre las partidas
+    #
+    # Uso:
+    #     driver = HeadlessDriver(service)
+    #     game = driver.add_session(bot=True)
+    #     driver.play(game, "e2e4")
+    #     for game in driver.poll(timeout=1): ...  # partidas donde el bot ya movio
+    
+    def __init__(self, service):
+        self.service = service
+        self.sessions = []
+        # Se activa cuando alguna partida tiene resultados nuevos del motor
+        self.wake = threading.Event()
+
+    def add_session(self, fen=None, bot=True, assistant=False, ponder=False):
+        # Crea una partida nueva; el ponder esta apagado por defecto para que
+        # las partidas sin jugador pensando no ocupen motores
+        game = GameSession(self.service, self.wake.set)
+        game.is_bot_enabled = bot
+        game.is_assistant_enabled = assistant
+        game.ponder = ponder
+        self.sessions.append(game)
+        game.set_position(fen)
+        return game
+
+    def remove_session(self, game):
+        # Termina una partida y cancela sus busquedas
+        game.close()
+        self.sessions.remove(game)
+
+    def play(self, game, move):
+        # Jugada del jugador en una partida (texto UCI o chess.Move)
+        # Lanza ValueError si no es legal o no es su turno
+        if isinstance(move, str):
+            move = chess.Move.from_uci(move)
+        if game.bot_to_move() or not game.board.info().is_legal(move):
+            raise ValueError(f"jugada invalida: {move}")
+        game.play_move(move)
+
+    def poll(self, timeout=None):
+        # Espera resultados del motor y los aplica
+        # Devuelve las partidas que cambiaron (lista vacia si se acabo el tiempo)
+        if not self.wake.wait(timeout):
+            return []
+        self.wake.clear()
+        return [game for game in list(self.sessions) if game.apply_engine_results()]
+
+    def close(self):
+        # Cancela las busquedas de todas las partidas (el servicio lo cierra quien lo abrio)
+        for game in self.sessions:
+            game.close()
+        self.sessions.clear()
+
+def spectator_state(game, frame):
+    # Estado de una partida que ven los espectadores (se arma en el hilo de la ventana)
+    # Las jugadas quedan como tupla para que el servidor las compare con las anteriores
+    info = game.board.info()
+    return {
+        "start": game.start_fen,
+        "moves": tuple(game.board.move_stack),
+        "frame": frame,
+        "suggestion": game.engine_suggestion.uci() if game.is_assistant_enabled and game.engine_suggestion else None,
+        "clock": [round(game.clock[chess.WHITE], 1), round(game.clock[chess.BLACK], 1)],
+        "bot": game.is_bot_enabled,
+        "result": info.outcome.result() if info.is_game_over else None,
+    }
+
+def spectator_full(state):
+    # Mensaje con el estado completo (al conectarse o al ponerse al dia)
+    return {
+        "type": "full",
+        "start": state["start"],
+        "moves": [move.uci() for move in state["moves"]],
+        "frame": list(state["frame"]),
+        "suggestion": state["suggestion"],
+        "clock": state["clock"],
+        "bot": state["bot"],
+        "result": state["result"],
+    }
+
+def spectator_delta(old, new):
+    # Mensaje con lo que cambio entre dos estados
+    # undo: jugadas que hay que sacar del final (reinicio), moves: jugadas nuevas,
+    # squares: casillas que cambiaron de color; el resto solo si cambio
+    if old is None or old["start"] != new["start"]:
+        return spectator_full(new)
+    message = {"type": "delta"}
+    old_moves, new_moves = old["moves"], new["moves"]
+    # Lo normal es que solo se agreguen jugadas al final
+    if new_moves[:len(old_moves)] == old_moves:
+        common = len(old_moves)
+    else:
+        common = 0
+        while common < min(len(old_moves), len(new_moves)) and old_moves[common] == new_moves[common]:
+            common += 1
+    if common < len(old_moves):
+        message["undo"] = len(old_moves) - common
+    if common < len(new_moves):
+        message["moves"] = [move.uci() for move in new_moves[common:]]
+    # compute_frame devuelve la misma tupla si los colores no cambiaron
+    if old["frame"] is not new["frame"]:
+        squares = {sq: color for sq, (before, color) in enumerate(zip(old["frame"], new["frame"])) if before != color}
+        if squares:
+            message["squares"] = squares
+    for key in ("suggestion", "clock", "bot", "result"):
+        if old[key] != new[key]:
+            message[key] = new[key]
+    return message
+
+def encode_message(message):
+    # Una linea JSON compacta lista para mandar
+    return (json.dumps(message, separators=(",", ":")) + "\n").encode("utf-8")
+
+class SpectatorClient:
+    # Un cliente conectado con su propia cola de mensajes ya codificados
+    # Solo se usa dentro del bucle del servidor
+    
+    def __init__(self, server, writer):
+        self.server = server
+        self.writer = writer
+        self.pending = deque()
+        self.wake = asyncio.Event()
+        # Indica que antes de seguir hay que mandarle el estado completo
+        self.needs_full = False
+        # Tarea que atiende al cliente y tarea que le escribe (para cerrarlas al salir)
+        self.handler = None
+        self.sender = None
+
+    def send(self, data):
+        # Encola un mensaje sin esperar; devuelve False si el cliente estaba atrasado
+        if self.needs_full:
+            # El estado completo que va a recibir ya incluye este cambio; se
+            # despierta igual por si se conecto antes del primer estado publicado
+            self.wake.set()
+            return True
+        if len(self.pending) >= self.server.queue_size:
+            # Cliente lento: se descarta lo pendiente y recibe todo de nuevo al ponerse al dia
+            self.resync()
+            return False
+        self.pending.append(data)
+        self.wake.set()
+        return True
+
+    def resync(self):
+        # Pide mandarle el estado completo en vez de los cambios pendientes
+        self.pending.clear()
+        self.needs_full = True
+        self.wake.set()
+
+    async def run(self):
+        # Escribe los mensajes del cliente; esperar a un cliente lento solo frena a este
+        try:
+            while True:
+                await self.wake.wait()
+                self.wake.clear()
+                if self.needs_full and self.server.state is not None:
+                    self.needs_full = False
+                    self.pending.clear()
+                    self.writer.write(self.server.full())
+                while self.pending:
+                    self.writer.write(self.pending.popleft())
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+
+class SpectatorServer:
+    # Servidor TCP para mirar la partida y jugar desde otro equipo
+    # Corre en su propio hilo con un bucle asyncio: la ventana solo deja el
+    # estado y sigue, y un cliente lento o colgado no frena a nadie
+    # Cada cambio se codifica una sola vez y se manda igual a todos los clientes
+    #
+    # Protocolo: una linea JSON por mensaje
+    #   servidor -> cliente
+    #     {"type": "full", "seq": n, "start": fen, "moves": [...], "frame": [64 colores],
+    #      "suggestion": uci, "clock": [blancas, negras], "bot": bool, "result": "1-0" o null}
+    #     {"type": "delta", "seq": n, "undo": k, "moves": [...], "squares": {"12": "#RRGGBB"}, ...}
+    #     {"type": "error", "error": texto}
+    #   cliente -> servidor
+    #     {"type": "move", "uci": "e2e4", "token": clave}
+    #     {"type": "sync"}  pide el estado completo (por ejemplo si falta un seq)
+    
+    def __init__(self, host=SPECTATOR_HOST, port=SPECTATOR_PORT, token=SPECTATOR_TOKEN,
+                 queue_size=SPECTATOR_QUEUE, notify=None):
+        self.host = host
+        self.port = port
+        # Clave para mover (None = nadie puede mover)
+        self.token = token
+        self.queue_size = queue_size
+        # Funcion que despierta a la ventana cuando llega una jugada remota
+        self.notify = notify or notify_engine_result
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.server = None
+        self.clients = set()
+        # Ultimo estado publicado (solo se usa en el hilo de la ventana)
+        self.published = None
+        # Ultimo estado enviado, su numero y su version completa ya codificada
+        # (solo se usan en el bucle del servidor)
+        self.state = None
+        self.seq = 0
+        self.full_data = None
+        # Jugadas de los clientes que espera la ventana: (cliente, texto UCI)
+        self.moves = queue.Queue()
+
+    def start(self):
+        # Arranca el bucle y abre el puerto (con puerto 0 el sistema elige uno libre)
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, self.host, self.port), self.loop).result()
+        self.port = self.server.sockets[0].getsockname()[1]
+        print(f"[Espectadores] Escuchando en {self.host}:{self.port}")
+
+    def publish(self, game, frame):
+        # Se llama desde la ventana en cada update_ui; nunca espera
+        state = spectator_state(game, frame)
+        if state == self.published:
+            return
+        self.published = state
+        self.loop.call_soon_threadsafe(self._broadcast, state)
+
+    def _broadcast(self, state):
+        start = time.perf_counter()
+        old, self.state = self.state, state
+        self.seq += 1
+        self.full_data = None
+        message = spectator_delta(old, state)
+        message["seq"] = self.seq
+        data = encode_message(message)
+        dropped = 0
+        for client in self.clients:
+            if not client.send(data):
+                dropped += 1
+        metrics.record("spectator_broadcast", time.perf_counter() - start, clients=len(self.clients), dropped=dropped)
+
+    def full(self):
+        # Estado completo codificado una sola vez por cambio para todos los que lo piden
+        if self.full_data is None:
+            message = spectator_full(self.state)
+            message["seq"] = self.seq
+            self.full_data = encode_message(message)
+        return self.full_data
+
+    async def _handle(self, reader, writer):
+        # Atiende a un cliente: al conectarse recibe el estado completo
+        client = SpectatorClient(self, writer)
+        client.handler = asyncio.current_task()
+        self.clients.add(client)
+        client.resync()
+        client.sender = asyncio.ensure_future(client.run())
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                self._command(client, line)
+        except (ConnectionError, ValueError):
+            # ValueError: linea demasiado larga
+            pass
+        finally:
+            self.clients.discard(client)
+            # Espera a que la tarea que escribe termine antes de cerrar
+            client.sender.cancel()
+            await asyncio.gather(client.sender, return_exceptions=True)
+            writer.close()
+
+    def _command(self, client, line):
+        # Mensaje de un cliente
+        try:
+            message = json.loads(line)
+            kind = message.get("type")
+        except (ValueError, AttributeError):
+            client.send(encode_message({"type": "error", "error": "mensaje invalido"}))
+            return
+        if kind == "sync":
+            client.resync()
+        elif kind == "move":
+            if self.token is None or message.get("token") != self.token:
+                client.send(encode_message({"type": "error", "error": "sin permiso para mover"}))
+                return
+            # La jugada se verifica y se juega en el hilo de la ventana
+            self.moves.put((client, str(message.get("uci", ""))))
+            self.notify()
+        else:
+            client.send(encode_message({"type": "error", "error": f"tipo desconocido: {kind}"}))
+
+    def apply_moves(self, game):
+        # Juega las jugadas de los clientes remotos (en el hilo de la ventana)
+        # Devuelve True si se jugo alguna
+        played = False
+        while True:
+            try:
+                client, text = self.moves.get_nowait()
+            except queue.Empty:
+                return played
+            move = remote_move(game, text)
+            if move is None:
+                self.reply(client, {"type": "error", "error": f"jugada invalida: {text}"})
+                continue
+            game.play_move(move)
+            played = True
+
+    def reply(self, client, message):
+        # Manda un mensaje a un solo cliente desde cualquier hilo
+        self.loop.call_soon_threadsafe(client.send, encode_message(message))
+
+    def close(self):
+        # Cierra el puerto y las conexiones y detiene el bucle
+        async def shutdown():
+            if self.server is not None:
+                self.server.close()
+            # Corta cada conexion y espera a que su tarea termine (la lectura ve el
+            # fin de la conexion y la tarea cierra tambien la que escribe)
+            # abort no espera a mandar lo pendiente a un cliente que no lee
+            handlers = [client.handler for client in self.clients]
+            for client in list(self.clients):
+                client.writer.transport.abort()
+            await asyncio.gather(*handlers, return_exceptions=True)
+        try:
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result(timeout=1)
+        except Exception as e:
+            print(f"[Espectadores] {e}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout=1)
+
+def remote_move(game, text):
+    # Convierte la jugada de un cliente en una jugada legal (None si no se puede jugar)
+    # Sin letra de coronacion se corona a reina, igual que en la ventana
+    try:
+        move = chess.Move.from_uci(text)
+    except ValueError:
+        return None
+    info = game.board.info()
+    if game.bot_to_move() or info.is_game_over:
+        return None
+    if move.promotion is None:
+        move = info.moves_from.get(move.from_square, {}).get(move.to_square)
+    return move if move is not None and info.is_legal(move) else None
+
+def open_spectator_server():
+    # Abre el servidor de espectadores si kchess.json tiene un puerto (None si no)
+    settings = load_config().get("spectator", {})
+    port = settings.get("port", SPECTATOR_PORT)
+    if port is None:
+        return None
+    server = SpectatorServer(settings.get("host", SPECTATOR_HOST), port, settings.get("token", SPECTATOR_TOKEN))
+    try:
+        server.start()
+    except OSError as e:
+        print(f"[Espectadores] No se pudo abrir el puerto {port}: {e}")
+        server.close()
+        return None
+    return server
+
+class MoveJournal:
+    # Registro de la partida en disco que sobrevive a un corte de luz
+    # Una linea de texto por cambio (ver GameSession.replay); la ventana solo
+    # agrega lineas a una lista y sigue, un hilo las escribe y hace fsync
+    # como mucho cada sync_interval segundos (todas juntas en una sola escritura)
+    
+    def __init__(self, path, sync_interval=JOURNAL_SYNC_INTERVAL):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        # Lineas agregadas que todavia no se escribieron
+        self.pending = []
+        # Estado completo que reemplaza todo el archivo (None si no hay)
+        self.replacement = None
+        # Lineas agregadas desde el ultimo estado completo
+        self.lines = 0
+        self.closed = False
+        self.file = open(path, "a", encoding="utf-8")
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def append(self, line):
+        # Agrega una linea sin esperar al disco (se llama desde la ventana)
+        with self.lock:
+            self.pending.append(line)
+            self.lines += 1
+        self.wake.set()
+
+    def reset(self, snapshot):
+        # Reemplaza todo el registro por una sola linea con el estado completo
+        # (partida nueva o registro demasiado largo)
+        with self.lock:
+            self.replacement = snapshot
+            self.pending = []
+            self.lines = 0
+        self.wake.set()
+
+    def _run(self):
+        last_sync = 0.0
+        while True:
+            self.wake.wait()
+            # Junta lo que llegue hasta el proximo fsync permitido
+            delay = last_sync + self.sync_interval - time.monotonic()
+            if delay > 0 and not self.closed:
+                time.sleep(delay)
+            with self.lock:
+                self.wake.clear()
+                replacement, self.replacement = self.replacement, None
+                lines, self.pending = self.pending, []
+            if replacement is not None or lines:
+                last_sync = time.monotonic()
+                self._write(replacement, lines)
+            if self.closed:
+                return
+
+    def _write(self, replacement, lines):
+        start = time.perf_counter()
+        try:
+            if replacement is not None:
+                self._replace(replacement)
+            if lines:
+                self.file.write("".join(line + "\n" for line in lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        except OSError as e:
+            # Sin registro se sigue jugando; solo se pierde la recuperacion
+            print(f"[Registro] No se pudo escribir {self.path}: {e}")
+            metrics.event("journal_error", error=repr(e))
+            return
+        metrics.record("journal_sync", time.perf_counter() - start, lines=len(lines), snapshot=replacement is not None)
+
+    def _replace(self, snapshot):
+        # Escribe el estado completo en un temporal y lo cambia por el registro
+        # Si se corta la luz queda el registro viejo o el nuevo, nunca uno a medias
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(snapshot + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.file.close()
+        os.replace(temp_path, self.path)
+        # El cambio de nombre queda en la carpeta: sin fsync de la carpeta un corte
+        # de luz puede volver al registro viejo y perder lo agregado despues
+        # (en Windows no se puede abrir una carpeta asi)
+        if os.name == "posix":
+            folder = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(folder)
+            finally:
+                os.close(folder)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def close(self):
+        # Escribe lo pendiente y cierra el archivo
+        self.closed = True
+        self.wake.set()
+        self.thread.join(timeout=ENGINE_TIMEOUT)
+        self.file.close()
+
+def open_journal(game):
+    # Recupera la partida del registro y lo sigue escribiendo (None si no se usa)
+    path = load_config().get("journal", JOURNAL_FILE)
+    if not path:
+        return None
+    start = time.perf_counter()
+    lines = []
     try:
-        # Abre conexion con el motor de ajedrez
-        with chess.engine.SimpleEngine.popen_uci(ENGINE_PATH) as engine:
-            # Verifica si hay movimientos nulos en el historial
-            if any(m == chess.Move.null() for m in current_board.move_stack):
-                # Crea tablero nuevo desde la posicion actual
-                temp_board = chess.Board(current_board.fen())
-            else:
-                # Usa el tablero directamente
-                temp_board = current_board
-            
-            # Le pide al motor que calcule el mejor movimiento
-            # Limite de 0.4 segundos para que sea rapido
-            result = engine.play(temp_board, chess.engine.Limit(time=0.4))
-            
-            # Pone el resultado en la cola para que el programa principal lo use
-            q.put(result.move)
-    except Exception as e:
-        # Si hay error lo muestra en la terminal
-        print(f"[Engine Error] {e}")
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        pass
+    except (OSError, UnicodeDecodeError) as e:
+        print(f"[Registro] No se pudo leer {path}: {e}")
+    used = game.replay(lines)
+    if lines:
+        elapsed = time.perf_counter() - start
+        metrics.record("journal_restore", elapsed, lines=used, moves=len(game.board.move_stack))
+        print(f"[Registro] Partida recuperada: {len(game.board.move_stack)} jugadas en {elapsed * 1000:.1f} ms")
+        if used < len(lines):
+            print(f"[Registro] Se ignoraron {len(lines) - used} lineas cortadas al final")
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        journal = MoveJournal(path)
+    except OSError as e:
+        print(f"[Registro] No se pudo abrir {path}: {e}")
+        return None
+    game.journal = journal
+    # Empieza con el estado recuperado (sin lineas viejas ni cortadas)
+    journal.reset(game.journal_snapshot())
+    return journal
+
+def export_pgn(game, path, black_name):
+    # Agrega la partida terminada al archivo PGN (una partida tras otra)
+    import chess.pgn
+    pgn_game = chess.pgn.Game.from_board(game.board)
+    pgn_game.headers["Event"] = APP_TITLE
+    pgn_game.headers["Date"] = time.strftime("%Y.%m.%d")
+    pgn_game.headers["White"] = "JUGADOR 1"
+    pgn_game.headers["Black"] = black_name
+    try:
+        with open(path, "a", encoding="utf-8") as f:
+            print(pgn_game, file=f, end="\n\n")
+    except OSError as e:
+        print(f"[PGN] No se pudo guardar {path}: {e}")
+
+# Partida que muestra la ventana
+session = GameSession()
 
 # --- SECCION 4: FUNCIONES DE DESCARGA DEL MOTOR ---
 
+# Segundos sin respuesta del servidor antes de dar el intento por fallado
+DOWNLOAD_TIMEOUT = 30
+
+# Reintentos de la descarga; cada uno sigue desde donde quedo el anterior
+DOWNLOAD_RETRIES = 3
+
+# Tamano de cada bloque que se lee de la red y se escribe al disco
+DOWNLOAD_CHUNK = 64 * 1024
+
+# SHA-256 conocido de cada archivo del motor: nombre del archivo -> hash
+# kchess.json puede agregar o cambiar valores con "engine_sha256": {"archivo": "hash"}
+# y usar otro servidor con "engine_url" (por ejemplo una copia en la red local)
+# Un archivo sin hash conocido se instala avisando su hash en la terminal,
+# salvo que se exija uno (ENGINE_REQUIRE_SHA256 o "engine_require_sha256": true)
+ENGINE_SHA256 = {}
+
+# Con True nunca se descarga ni se instala un archivo sin hash conocido
+ENGINE_REQUIRE_SHA256 = False
+
 def get_engine_url():
     # Determina cual version de Stockfish descargar
     # Depende del sistema operativo y procesador
@@ -287,18 +2786,185 @@ def get_engine_url():
     # Si no es Windows ni Linux no hace nada
     return None, None
 
-def ensure_engine():
+def available_memory_mb():
+    # Devuelve la memoria disponible en MB (None si no se puede saber)
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) // 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") // (1024 * 1024)
+    except (ValueError, OSError, AttributeError):
+        return None
+
+def load_config():
+    # Lee el archivo de configuracion del operador (si existe)
+    if not os.path.isfile(CONFIG_FILE):
+        return {}
+    try:
+        with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[Config] No se pudo leer {CONFIG_FILE}: {e}")
+        return {}
+
+def detect_engine_profile():
+    # Ajusta el motor al equipo: cantidad de nucleos y memoria disponible
+    # Devuelve procesos, opciones UCI (Threads, Hash) y limites por rol
+    config = load_config()
+    cores = os.cpu_count() or 1
+    memory = available_memory_mb()
+    try:
+        pool_size = int(config.get("pool_size", ENGINE_POOL_SIZE))
+    except (TypeError, ValueError):
+        pool_size = 0
+    if pool_size < 1:
+        # Con menos de un proceso no hay motor; se usa el valor por defecto
+        print(f"[Config] pool_size invalido en {CONFIG_FILE}: {config.get('pool_size')!r}, se usa {ENGINE_POOL_SIZE}")
+        pool_size = ENGINE_POOL_SIZE
+    
+    # Reparte los nucleos entre los motores y deja uno libre para la ventana
+    threads = max(1, (cores - 1) // pool_size)
+    
+    # Usa como maximo 1/8 de la memoria libre para las tablas hash (16 MB a 1 GB por motor)
+    hash_mb = 16 if memory is None else min(1024, max(16, memory // 8 // pool_size))
+    
+    # En equipos chicos el asistente busca menos para dejarle CPU al bot y a la ventana
+    # (tambien el analisis continuo, que si no ocupa un nucleo hasta ANALYSIS_MAX_TIME)
+    limits = {"bot": "time=0.4", "assistant": "time=0.25" if cores <= 2 else "time=0.4"}
+    analysis_time = ANALYSIS_SMALL_MAX_TIME if cores <= 2 else ANALYSIS_MAX_TIME
+    
+    # El operador puede cambiar cualquier valor desde el archivo de configuracion
+    options = {"Threads": threads, "Hash": hash_mb}
+    options.update(config.get("options", {}))
+    limits.update(config.get("limits", {}))
+    analysis_time = config.get("analysis_time", analysis_time)
+    return {"pool_size": pool_size, "options": options, "limits": limits, "analysis_time": analysis_time,
+            "cores": cores, "memory": memory}
+
+def hash_file(path, digest):
+    # Agrega a digest el contenido de un archivo leyendolo por bloques
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+            digest.update(block)
+    return digest
+
+def download_file(url, path, sha256=None, progress=None):
+    # Descarga url en path por bloques sin cargar el archivo en memoria
+    # Lo descargado se escribe en path.part; si ya existe de un intento anterior
+    # sigue desde ahi pidiendo solo lo que falta (encabezado HTTP Range)
+    # Solo cuando el tamano y el SHA-256 son correctos renombra path.part a path
+    # progress recibe (bytes descargados, bytes totales o None)
+    import hashlib
+    import http.client
+    import urllib.error
+    import urllib.request
+    part = path + ".part"
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        done = os.path.getsize(part) if os.path.exists(part) else 0
+        headers = {"Range": f"bytes={done}-"} if done else {}
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=DOWNLOAD_TIMEOUT) as response:
+                # Si el servidor no acepta Range manda todo y se empieza de cero
+                if response.status != 206:
+                    done = 0
+                total = response.length + done if response.length is not None else None
+                # El hash se calcula mientras se descarga (sin volver a leer el archivo)
+                digest = hash_file(part, hashlib.sha256()) if done else hashlib.sha256()
+                with open(part, "ab" if done else "wb") as f:
+                    for chunk in iter(lambda: response.read(DOWNLOAD_CHUNK), b""):
+                        f.write(chunk)
+                        digest.update(chunk)
+                        done += len(chunk)
+                        if progress:
+                            progress(done, total)
+            if total is not None and done < total:
+                raise ConnectionError(f"descarga incompleta ({done} de {total} bytes)")
+            break
+        except urllib.error.HTTPError as e:
+            # 416: se pidio desde despues del final, el archivo ya estaba completo
+            if e.code != 416 or not done:
+                raise
+            digest = hash_file(part, hashlib.sha256())
+            break
+        except (OSError, http.client.HTTPException) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            print(f"[Descarga] {e}, reintentando desde {done} bytes...")
+    
+    # Un archivo danado no se instala nunca: se borra para bajarlo de nuevo
+    if sha256:
+        if digest.hexdigest() != sha256.lower():
+            os.remove(part)
+            raise ValueError(f"SHA-256 incorrecto en {os.path.basename(path)}")
+    else:
+        print(f"[Descarga] Sin SHA-256 conocido para {os.path.basename(path)}: {digest.hexdigest()}")
+    os.replace(part, path)
+    return path
+
+def is_engine_member(name):
+    # Indica si un archivo del paquete parece el ejecutable de Stockfish
+    # (contiene stockfish en el nombre y no es documentacion)
+    base = os.path.basename(name).lower()
+    return "stockfish" in base and not base.endswith(('.txt', '.md', '.zip', '.tar'))
+
+def extract_engine(archive_path, target_path):
+    # Copia solo el ejecutable del motor desde el archivo comprimido, sin
+    # descomprimir lo demas, y lo instala de una vez (archivo temporal + rename)
+    # Asi un corte a mitad de camino nunca deja un motor roto en target_path
+    # Devuelve False si el paquete no tiene el ejecutable
+    import shutil
+    import tarfile
+    import zipfile
+    temp_path = target_path + ".tmp"
+    found = False
+    if archive_path.endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as z:
+            name = next((n for n in z.namelist() if not n.endswith("/") and is_engine_member(n)), None)
+            if name:
+                with z.open(name) as source, open(temp_path, "wb") as out:
+                    shutil.copyfileobj(source, out, DOWNLOAD_CHUNK)
+                found = True
+    else:
+        # "r|*" lee el tar en orden como un flujo (sin indice ni saltos)
+        # y se detiene apenas encuentra el ejecutable
+        with tarfile.open(archive_path, "r|*") as t:
+            for member in t:
+                if member.isfile() and is_engine_member(member.name):
+                    with t.extractfile(member) as source, open(temp_path, "wb") as out:
+                        shutil.copyfileobj(source, out, DOWNLOAD_CHUNK)
+                    found = True
+                    break
+    if not found:
+        return False
+    
+    # Da permisos de ejecucion en Linux
+    if platform.system() != "Windows":
+        os.chmod(temp_path, 0o755)
+    # Borra lo que hubiera en el lugar (una carpeta de versiones viejas)
+    if os.path.isdir(target_path):
+        shutil.rmtree(target_path)
+    os.replace(temp_path, target_path)
+    return True
+
+def ensure_engine(status=None):
     # Verifica que el motor este instalado
     # Si no lo esta lo descarga automaticamente
+    # status recibe los textos de avance para mostrarlos (None = solo la terminal)
     
     # Crea la carpeta de motores si no existe
     if not os.path.exists(ENGINE_FOLDER):
         os.makedirs(ENGINE_FOLDER)
     
-    # Obtiene la URL de descarga correcta
+    # Obtiene la URL de descarga correcta (kchess.json puede indicar otra)
     exe_name, url = get_engine_url()
     if not exe_name: 
         return None
+    config = load_config()
+    url = config.get("engine_url", url)
     
     # Construye la ruta completa al motor
     target_path = os.path.normpath(os.path.join(ENGINE_FOLDER, exe_name))
@@ -316,92 +2982,237 @@ def ensure_engine():
             os.chmod(target_path, 0o755)
         return target_path
     
+    # El archivo se guarda con su nombre original para poder retomarlo y verificarlo
+    archive_name = url.rsplit("/", 1)[-1]
+    archive_path = os.path.join(ENGINE_FOLDER, archive_name)
+    sha256 = config.get("engine_sha256", {}).get(archive_name) or ENGINE_SHA256.get(archive_name)
+    if not sha256 and config.get("engine_require_sha256", ENGINE_REQUIRE_SHA256):
+        # Sin hash no se puede saber si el archivo es el original: no se descarga
+        print(f"Error descarga: sin SHA-256 conocido para {archive_name}. Copialo de la pagina de la version "
+              f"a {CONFIG_FILE} como {{\"engine_sha256\": {{\"{archive_name}\": \"...\"}}}} o instala Stockfish en {ENGINE_FOLDER}")
+        return None
+    
     # Si llega aqui necesita descargar
     print(f"Descargando Stockfish para {platform.system()}...")
-    sg.popup_quick_message("Descargando motor...", background_color='#333333')
+    if status:
+        status("Descargando motor...")
+    
+    # Muestra el avance solo cuando cambia el porcentaje (o cada MB si no se sabe el total)
+    shown = [None]
+    def progress(done, total):
+        step = done * 100 // total if total else done // (1024 * 1024)
+        if step != shown[0]:
+            shown[0] = step
+            if status:
+                status(f"Descargando motor... {step}%" if total else f"Descargando motor... {step} MB")
     
     try:
-        # Nombre del archivo temporal segun tipo
-        temp_name = "temp_engine.zip" if ".zip" in url else "temp_engine.tar"
-        temp_path = os.path.join(ENGINE_FOLDER, temp_name)
-        
-        # Descarga el archivo
-        urllib.request.urlretrieve(url, temp_path)
-        
-        # Carpeta temporal para extraer
-        extract_dir = os.path.join(ENGINE_FOLDER, "temp_extraction")
-        if os.path.exists(extract_dir):
-            shutil.rmtree(extract_dir)
-        
-        # Extrae el archivo segun su tipo
-        if temp_path.endswith(".zip"):
-            with zipfile.ZipFile(temp_path, 'r') as z: 
-                z.extractall(extract_dir)
-        else:
-            with tarfile.open(temp_path, 'r') as t: 
-                t.extractall(extract_dir)
-        
-        # Busca el ejecutable de Stockfish en las carpetas extraidas
-        found_bin_path = None
-        for root, dirs, files in os.walk(extract_dir):
-            for file in files:
-                # Busca archivo que contenga stockfish y no sea documentacion
-                if "stockfish" in file.lower() and not file.endswith(('.txt', '.md', '.zip', '.tar')):
-                    found_bin_path = os.path.join(root, file)
-                    break
-            if found_bin_path: 
-                break
-
-        # Si encontro el ejecutable lo mueve a su ubicacion final
-        if found_bin_path:
-            # Borra el archivo anterior si existe
-            if os.path.exists(target_path):
-                if os.path.isdir(target_path): 
-                    shutil.rmtree(target_path)
-                else: 
-                    os.remove(target_path)
-            
-            # Mueve el ejecutable a su ubicacion final
-            shutil.move(found_bin_path, target_path)
-            
-            # Limpia archivos temporales
-            shutil.rmtree(extract_dir)
-            if os.path.exists(temp_path): 
-                os.remove(temp_path)
-            
-            # Da permisos de ejecucion en Linux
-            if platform.system() != "Windows":
-                os.chmod(target_path, 0o755)
-            
-            return target_path
+        download_file(url, archive_path, sha256, progress)
+        if not extract_engine(archive_path, target_path):
+            print(f"Error descarga: no hay ejecutable de Stockfish en {archive_name}")
+            return None
+        # El archivo comprimido ya no hace falta
+        os.remove(archive_path)
+        return target_path
     except Exception as e:
+        # Lo descargado a medias queda en <archivo>.part para seguir la proxima vez
         print(f"Error descarga: {e}")
     
     return None
 
 # --- SECCION 5: FUNCION PRINCIPAL ---
 
+def handle_square_click(window, event):
+    # Maneja un clic en una casilla del tablero
+    # event es la clave del boton: (fila, columna)
+    board = session.board
+    
+    # No permite clicks si es turno del bot
+    if session.bot_to_move():
+        return
+
+    # Convierte las coordenadas del clic a indice de casilla
+    sq = chess.square(event[1], event[0])
+
+    # Si no hay casilla seleccionada (primer clic)
+    if session.selected_square is None:
+        # Obtiene la pieza en esta casilla
+        piece = board.piece_at(sq)
+
+        # Si hay pieza y es del turno actual
+        if piece and piece.color == board.turn:
+            # Selecciona esta casilla
+            session.selected_square = sq
+            # Movimientos validos desde aqui (ya calculados para esta posicion)
+            session.valid_moves_squares = board.info().moves_from.get(sq, {})
+
+        # Si hay pieza pero no es del turno actual
+        elif piece:
+            sg.popup_quick_message("Turno incorrecto", background_color='red', text_color='white')
+
+    # Si ya hay casilla seleccionada (segundo clic)
+    else:
+        # Si hace clic en la misma casilla cancela la seleccion
+        if sq == session.selected_square:
+            session.reset_selection()
+            update_ui(window)
+            return
+
+        # Busca si existe un movimiento valido a esta casilla
+        # (si es peon que llega al final ya viene la coronacion a reina)
+        move = session.valid_moves_squares.get(sq)
+
+        # Si el movimiento es valido
+        if move:
+            # Ejecuta el movimiento y activa bot o asistente
+            session.play_move(move)
+
+        # Si el movimiento no es valido
+        else:
+            # Pinta la casilla de rojo
+            if board_canvas is not None:
+                board_canvas.paint(event, drawn_squares[event][0], COLORS["ERROR"], drawn_squares[event])
+            else:
+                window[event].update(button_color=('white', COLORS["ERROR"]))
+                window[event].Widget.config(activebackground=COLORS["ERROR"])
+            # Olvida lo dibujado en esta casilla para que se repinte despues
+            drawn_squares.pop(event, None)
+            # Actualiza la pantalla para que se vea el rojo
+            window.refresh()
+            # Muestra mensaje de error
+            sg.popup_quick_message("MOVIMIENTO INVALIDO", text_color='white', background_color=COLORS["ERROR"])
+            # Espera un poco para que el usuario lo vea
+            time.sleep(0.3)
+            # Limpia la seleccion
+            session.reset_selection()
+
+    # Actualiza la interfaz
+    update_ui(window)
+
+
+def bootstrap_engine():
+    # Corre en un hilo de fondo con la ventana ya abierta
+    # Busca o descarga el motor, ajusta el perfil al equipo y abre los procesos
+    # Cada paso se avisa por bootstrap_queue y despierta a la ventana con ENGINE_EVENT
+    def status(text):
+        bootstrap_queue.put(("status", text))
+        notify_engine_result()
+    
+    start = time.perf_counter()
+    try:
+        path = ensure_engine(status)
+        if not path:
+            bootstrap_queue.put(("error", "No se pudo configurar el motor"))
+            return
+        
+        # Ajusta procesos, hilos, memoria y limites del motor a este equipo
+        profile = detect_engine_profile()
+        try:
+            limits = {role: parse_limit(text) for role, text in profile["limits"].items()}
+        except (ValueError, argparse.ArgumentTypeError) as e:
+            print(f"[Config] Limite invalido en {CONFIG_FILE}: {e}")
+            limits = ENGINE_LIMITS
+        print(f"Perfil del motor: {profile['cores']} nucleos, {profile['memory']} MB libres, "
+              f"{profile['pool_size']} procesos, opciones {profile['options']}, limites {profile['limits']}, "
+              f"analisis {profile['analysis_time']} s")
+        
+        # Abre los procesos del motor una sola vez para todo el programa
+        status("Iniciando motor...")
+        service = EngineService(path, profile["pool_size"], profile["options"])
+        service.start()
+        # Carga los analisis guardados de sesiones anteriores
+        cache = AnalysisCache()
+        cache.load(ANALYSIS_CACHE_FILE)
+        # Abre el libro de aperturas y las tablas de finales si existen
+        open_book_and_tablebases()
+        metrics.record("engine_bootstrap", time.perf_counter() - start)
+        bootstrap_queue.put(("ready", (path, limits, service, cache, profile["pool_size"], profile["analysis_time"])))
+    except Exception as e:
+        print(f"[Engine Error] {e}")
+        metrics.event("engine_error", error=repr(e))
+        bootstrap_queue.put(("error", "No se pudo iniciar el motor"))
+    finally:
+        notify_engine_result()
+
+def apply_bootstrap_updates():
+    # Usa los avisos del arranque del motor (en el hilo de la ventana)
+    # Devuelve True si algo cambio y hay que redibujar
+    global ENGINE_PATH, ENGINE_LIMITS, ANALYSIS_MAX_TIME, engine_service, analysis_cache, engine_status
+    changed = False
+    while True:
+        try:
+            kind, data = bootstrap_queue.get_nowait()
+        except queue.Empty:
+            return changed
+        changed = True
+        if kind == "status":
+            engine_status = data
+        elif kind == "error":
+            # Sin motor se sigue pudiendo jugar entre dos jugadores
+            engine_status = "Motor no disponible (solo jugador contra jugador)"
+            if engine_window is not None:
+                sg.popup_error(data)
+        elif kind == "ready":
+            ENGINE_PATH, ENGINE_LIMITS, engine_service, analysis_cache, pool_size, ANALYSIS_MAX_TIME = data
+            session.scheduler = EngineScheduler(engine_service, pool_size, session)
+            engine_status = ""
+            # Si el bot o el asistente se activaron mientras arrancaba ahora piden su jugada
+            if engine_window is not None:
+                session.request_next()
+
 def main():
     # Funcion principal que inicia todo el programa
     
     # Permite modificar las variables globales
-    global selected_square, valid_moves_squares, is_bot_enabled, is_assistant_enabled, engine_suggestion, game_over_notified, ENGINE_PATH
+    global engine_window, is_metrics_visible, engine_status, led_output, board_canvas, spectator_server, PGN_EXPORT_FILE
     
-    # Verifica que el motor este instalado
-    engine_found = ensure_engine()
-    if engine_found:
-        ENGINE_PATH = engine_found
-    else:
-        # Si no hay motor muestra error y sale
-        sg.popup_error("No se pudo configurar el motor")
+    # Tablero en 64 botones o en un solo lienzo (kchess.json lo puede cambiar)
+    config = load_config()
+    renderer = config.get("board_renderer", BOARD_RENDERER)
+    square_size = config.get("canvas_square", CANVAS_SQUARE_SIZE) or IMG_SIZE
+    image_size = IMG_SIZE
+    if renderer == "canvas":
+        # En el lienzo las casillas pueden ser mas grandes que las imagenes:
+        # usa el juego de imagenes mas grande que entra en la casilla
+        image_size = max([size for size in available_image_sizes() if size <= square_size], default=IMG_SIZE)
+    
+    # Lee las imagenes de las piezas del disco una sola vez
+    try:
+        load_piece_images(image_size)
+    except OSError as e:
+        print(f"[Error Imagenes] {e} (tamanos disponibles: {available_image_sizes()})")
+        sg.popup_error("No se encontraron las imagenes de las piezas")
         return
 
+    # Registro de mediciones, archivo de estado y puerto local (kchess.json los puede cambiar)
+    settings = config.get("metrics", {})
+    metrics.open_log(settings.get("log", METRICS_LOG_FILE))
+    metrics.start(settings.get("status", METRICS_STATUS_FILE), settings.get("port", METRICS_PORT))
+    
+    # Abre los LEDs configurados (el tablero se manda en cada update_ui)
+    led_output = open_led_output()
+    
+    # Abre el servidor de espectadores y juego remoto si esta configurado
+    spectator_server = open_spectator_server()
+    
+    # Recupera la partida que estaba en juego (por ejemplo despues de un corte de luz)
+    # y anota cada cambio desde ahora; las partidas terminadas se pueden exportar a PGN
+    journal = open_journal(session)
+    PGN_EXPORT_FILE = config.get("pgn_export", PGN_EXPORT_FILE)
+    
     # Establece el tema visual oscuro
     sg.theme('DarkGrey15')
     
     # Crea la matriz de botones del tablero (8x8)
     # Se crea de abajo hacia arriba (rango 7 a 0) para que coincida con ajedrez
     board_layout = [[sg.Button('', size=(4, 2), key=(r, f), border_width=0, pad=(0,0)) for f in range(8)] for r in range(7, -1, -1)]
+    board_element = sg.Column(board_layout, background_color='#000000', pad=(0, 0))
+    
+    # O un solo lienzo: los clics llegan como '-BOARD-' con el punto (x, y)
+    if renderer == "canvas":
+        side = 8 * square_size
+        board_element = sg.Graph((side, side), (0, 0), (side, side), key='-BOARD-',
+                                 enable_events=True, background_color='#000000', pad=(0, 0))
 
     # Layout completo de la ventana
     layout = [
@@ -409,11 +3220,20 @@ def main():
         [sg.Push(), sg.Text('●', key='-IND-P2-', font=(24), pad=(0,10)), sg.Text('', key='-LABEL-P2-', font=('Helvetica', 11, 'bold'), pad=(5,10)), sg.Push()],
         
         # Tablero de ajedrez
-        [sg.Push(), sg.Column(board_layout, background_color='#000000', pad=(0, 0)), sg.Push()],
+        [sg.Push(), board_element, sg.Push()],
         
         # Fila inferior con indicador y etiqueta del jugador 1
         [sg.Push(), sg.Text('●', key='-IND-P1-', font=(24), pad=(0,10)), sg.Text('', key='-LABEL-P1-', font=('Helvetica', 11, 'bold'), pad=(5,10)), sg.Push()],
         
+        # Estado del motor mientras arranca en segundo plano
+        [sg.Push(), sg.Text('', key='-STATUS-', font=('Helvetica', 9), text_color='#AAAAAA', size=(40, 1), justification='c', pad=(0, 0)), sg.Push()],
+        
+        # Lineas del analisis continuo del asistente
+        [sg.Push(), sg.Text('', key='-ANALYSIS-', font=('Courier', 9), size=(52, ANALYSIS_MULTIPV), pad=(0, 2)), sg.Push()],
+        
+        # Mediciones de tiempos y recursos (oculto hasta apretar METRICAS)
+        [sg.Push(), sg.Text('', key='-METRICS-TEXT-', font=('Courier', 8), size=(64, len(METRICS_LABELS) + 2), pad=(0, 2), visible=False), sg.Push()],
+        
         # Fila de botones principales
         [sg.Push(), 
          sg.Button('REINICIAR', key='RESTART', size=(10, 1), pad=(3,3)), 
@@ -424,37 +3244,66 @@ def main():
         [sg.Push(), 
          sg.Button('CARGAR FEN', key='-SET-BOARD-', size=(12, 1), pad=(3,3)), 
          sg.Button('SALTAR TURNO', key='-SKIP-', size=(12, 1), pad=(3,3)), 
+         sg.Button('METRICAS', key='-METRICS-', size=(9, 1), pad=(3,3)), 
          sg.Button('SALIR', key='EXIT', size=(8, 1), pad=(3,3)), sg.Push()]
     ]
 
     # Crea la ventana con el layout definido
     window = sg.Window(APP_TITLE, layout, finalize=True, element_justification='c', margins=(0,0))
     
-    # Configura cada casilla del tablero
-    for r in range(8):
-        for f in range(8):
-            # Obtiene el color inicial de esta casilla
-            current_bg = get_sq_color(chess.square(f, r))
-            # Configura propiedades especiales del boton
-            window[(r, f)].Widget.config(
-                takefocus=0,  # no acepta foco del teclado
-                activebackground=current_bg,  # color al hacer clic
-                activeforeground='white'  # color del texto al hacer clic
-            )
+    # Decodifica las 13 imagenes una sola vez para todas las casillas
+    build_piece_photos(image_size)
+    
+    # Crea los rectangulos y las imagenes del lienzo una sola vez
+    if renderer == "canvas":
+        board_canvas = CanvasBoard(window['-BOARD-'].Widget, square_size)
+    else:
+        # Configura cada casilla del tablero
+        for r in range(8):
+            for f in range(8):
+                # Obtiene el color inicial de esta casilla
+                current_bg = get_sq_color(chess.square(f, r))
+                # Configura propiedades especiales del boton
+                window[(r, f)].Widget.config(
+                    takefocus=0,  # no acepta foco del teclado
+                    activebackground=current_bg,  # color al hacer clic
+                    activeforeground='white'  # color del texto al hacer clic
+                )
+    
+    # Los hilos del motor despiertan a esta ventana cuando terminan
+    engine_window = window
     
     # Actualiza la interfaz por primera vez
-    update_ui(window)
+    engine_status = "Buscando motor..."
+    update_ui(window, full=True)
+    
+    # El motor se busca, descarga y abre en segundo plano con la ventana ya visible
+    # Mientras tanto se puede jugar entre dos jugadores
+    bootstrap = threading.Thread(target=bootstrap_engine, daemon=True)
+    bootstrap.start()
 
     # Bucle principal del programa (se repite mientras la ventana este abierta)
     while True:
-        # Lee eventos de la interfaz cada 100 milisegundos
-        # Para Raspberry Pi: 100ms es buen balance entre respuesta y CPU
-        event, values = window.read(timeout=100)
+        # Espera sin limite de tiempo hasta que haya un evento
+        # Los resultados del motor llegan como ENGINE_EVENT, asi que no hace
+        # falta revisar las colas periodicamente (CPU casi cero en reposo)
+        # Solo con las mediciones visibles se despierta cada METRICS_INTERVAL para refrescarlas
+        event, values = window.read(timeout=METRICS_INTERVAL * 1000 if is_metrics_visible else None)
         
         # Si se cierra la ventana sale del bucle
         if event == sg.WIN_CLOSED: 
             break
 
+        # Refresca las mediciones visibles
+        if event == sg.TIMEOUT_EVENT:
+            update_ui(window)
+            continue
+
+        # Clic en el lienzo: convierte el punto en la clave de la casilla
+        # (desde aqui se maneja igual que un clic en los botones)
+        if event == '-BOARD-':
+            event = board_canvas.square_at(values['-BOARD-'])
+
         # Manejo de botones que necesitan confirmacion
         if event in ('RESTART', 'EXIT', '-TOGGLE-BOT-'):
             # Si es el primer clic pide confirmacion
@@ -471,42 +3320,25 @@ def main():
                 if event == 'EXIT': 
                     break
                 
-                # Reinicia el juego
-                if event == 'RESTART':
-                    board.reset()
-                    game_over_notified = False
-                
                 # Cambia entre modo jugador y bot
                 if event == '-TOGGLE-BOT-':
-                    is_bot_enabled = not is_bot_enabled
-                    board.reset()
-                    game_over_notified = False
-                
-                # Limpia la seleccion actual
-                reset_selection()
-                update_ui(window)
+                    session.is_bot_enabled = not session.is_bot_enabled
                 
-                # Si el asistente esta activo lo reactiva
-                if is_assistant_enabled and not board.is_game_over() and not (is_bot_enabled and board.turn == chess.BLACK):
-                    threading.Thread(target=engine_thread_func, args=(board.copy(), suggestion_queue), daemon=True).start()
+                # Reinicia el juego: cancela las busquedas de la partida anterior
+                # y si el asistente esta activo lo reactiva
+                session.set_position()
+                update_ui(window, full=True)
                 continue
 
         # Limpia confirmaciones si se hace cualquier otra accion
-        if event not in (None, sg.TIMEOUT_EVENT):
+        if event not in (None, sg.TIMEOUT_EVENT, ENGINE_EVENT):
             confirm_states.clear()
 
         # Boton de saltar turno
         if event == '-SKIP-':
-            # Hace un movimiento nulo (pasa el turno)
-            board.push(chess.Move.null())
-            reset_selection()
+            # Hace un movimiento nulo y pide la jugada del bot o la sugerencia
+            session.skip_turn()
             update_ui(window)
-            # Si es modo bot inicia su movimiento
-            if is_bot_enabled and board.turn == chess.BLACK:
-                threading.Thread(target=engine_thread_func, args=(board.copy(), move_queue), daemon=True).start()
-            # Si el asistente esta activo recalcula sugerencia
-            elif is_assistant_enabled:
-                threading.Thread(target=engine_thread_func, args=(board.copy(), suggestion_queue), daemon=True).start()
             continue
 
         # Boton de cargar posicion FEN
@@ -515,133 +3347,763 @@ def main():
             fen = sg.popup_get_text("Posicion FEN:", title="Cargar")
             if fen:
                 try:
-                    # Intenta cargar la posicion
-                    board.set_fen(fen)
-                    reset_selection()
-                    game_over_notified = False
-                    update_ui(window)
-                    # Si es turno del bot lo activa
-                    if is_bot_enabled and board.turn == chess.BLACK and not board.is_game_over():
-                        threading.Thread(target=engine_thread_func, args=(board.copy(), move_queue), daemon=True).start()
+                    # Intenta cargar la posicion (si es turno del bot lo activa)
+                    session.set_position(fen)
+                    update_ui(window, full=True)
                 except:
                     # Si el FEN es invalido muestra error
                     sg.popup_error("FEN Invalido")
             continue
 
+        # Boton de mostrar u ocultar las mediciones
+        if event == '-METRICS-':
+            is_metrics_visible = not is_metrics_visible
+            # Toma una muestra de recursos para no mostrar datos viejos
+            if is_metrics_visible:
+                metrics.sample_resources()
+            update_ui(window)
+            continue
+
         # Boton de activar asistente
         if event == '-ASISTENTE-':
             # Cambia el estado del asistente
-            is_assistant_enabled = not is_assistant_enabled
-            # Si se activo calcula primera sugerencia
-            if is_assistant_enabled and not board.is_game_over() and not (is_bot_enabled and board.turn == chess.BLACK):
-                threading.Thread(target=engine_thread_func, args=(board.copy(), suggestion_queue), daemon=True).start()
-            else:
-                # Si se desactivo borra la sugerencia
-                engine_suggestion = None
+            session.set_assistant(not session.is_assistant_enabled)
             update_ui(window)
             continue
 
         # Manejo de clics en las casillas del tablero
-        if isinstance(event, tuple) and not board.is_game_over():
-            # No permite clicks si es turno del bot
-            if is_bot_enabled and board.turn == chess.BLACK: 
-                continue
-            
-            # Convierte las coordenadas del clic a indice de casilla
-            sq = chess.square(event[1], event[0])
-            
-            # Si no hay casilla seleccionada (primer clic)
-            if selected_square is None:
-                # Obtiene la pieza en esta casilla
-                piece = board.piece_at(sq)
-                
-                # Si hay pieza y es del turno actual
-                if piece and piece.color == board.turn:
-                    # Selecciona esta casilla
-                    selected_square = sq
-                    # Calcula todos los movimientos validos desde aqui
-                    valid_moves_squares = {m.to_square: m for m in board.legal_moves if m.from_square == sq}
-                
-                # Si hay pieza pero no es del turno actual
-                elif piece:
-                    sg.popup_quick_message("Turno incorrecto", background_color='red', text_color='white')
-            
-            # Si ya hay casilla seleccionada (segundo clic)
-            else:
-                # Si hace clic en la misma casilla cancela la seleccion
-                if sq == selected_square:
-                    reset_selection()
-                    update_ui(window)
-                    continue
+        if isinstance(event, tuple) and not session.board.info().is_game_over:
+            handle_square_click(window, event)
 
-                # Busca si existe un movimiento valido a esta casilla
-                move = next((m for m in board.legal_moves if m.from_square == selected_square and m.to_square == sq), None)
-                
-                # Si el movimiento es valido
-                if move:
-                    # Si es peon que llega al final lo promociona a reina
-                    if board.piece_at(selected_square).piece_type == chess.PAWN and chess.square_rank(move.to_square) in (0, 7):
-                        move.promotion = chess.QUEEN
-                    
-                    # Ejecuta el movimiento en el tablero
-                    board.push(move)
-                    reset_selection()
-                    
-                    # Si el juego no termino activa bot o asistente
-                    if not board.is_game_over():
-                        if is_bot_enabled and board.turn == chess.BLACK:
-                            threading.Thread(target=engine_thread_func, args=(board.copy(), move_queue), daemon=True).start()
-                        elif is_assistant_enabled:
-                            threading.Thread(target=engine_thread_func, args=(board.copy(), suggestion_queue), daemon=True).start()
-                
-                # Si el movimiento no es valido
-                else:
-                    # Pinta la casilla de rojo
-                    window[event].update(button_color=('white', COLORS["ERROR"]))
-                    window[event].Widget.config(activebackground=COLORS["ERROR"])
-                    # Actualiza la pantalla para que se vea el rojo
-                    window.refresh()
-                    # Muestra mensaje de error
-                    sg.popup_quick_message("MOVIMIENTO INVALIDO", text_color='white', background_color=COLORS["ERROR"])
-                    # Espera un poco para que el usuario lo vea
-                    time.sleep(0.3)
-                    # Limpia la seleccion
-                    reset_selection()
-            
-            # Actualiza la interfaz
+        # Verifica si el arranque del motor tiene novedades
+        if event == ENGINE_EVENT and apply_bootstrap_updates():
             update_ui(window)
 
-        # Verifica si el bot termino de calcular su movimiento
-        try:
-            # Intenta obtener movimiento de la cola sin esperar
-            bot_move = move_queue.get_nowait()
-            # Ejecuta el movimiento del bot
-            board.push(bot_move)
-            # Borra la sugerencia anterior
-            engine_suggestion = None
-            # Si el asistente esta activo calcula nueva sugerencia
-            if is_assistant_enabled and not board.is_game_over():
-                threading.Thread(target=engine_thread_func, args=(board.copy(), suggestion_queue), daemon=True).start()
+        # Jugadas de los clientes remotos (tambien despiertan con ENGINE_EVENT)
+        if event == ENGINE_EVENT and spectator_server is not None and spectator_server.apply_moves(session):
             update_ui(window)
-        except queue.Empty:
-            # Si no hay movimiento del bot continua
-            pass
 
-        # Verifica si hay nueva sugerencia del asistente
-        try:
-            # Intenta obtener sugerencia de la cola
-            new_sugg = suggestion_queue.get_nowait()
-            # Verifica que la sugerencia sea legal
-            if new_sugg in board.legal_moves:
-                engine_suggestion = new_sugg
-                update_ui(window)
-        except queue.Empty:
-            # Si no hay sugerencia continua
-            pass
+        # Usa la jugada del bot, la sugerencia o las lineas del analisis que hayan llegado
+        if session.apply_engine_results():
+            update_ui(window)
 
     # Cierra la ventana al salir del bucle
+    engine_window = None
     window.close()
+    # Si el motor seguia arrancando espera un poco y usa lo que haya abierto para cerrarlo
+    bootstrap.join(timeout=ENGINE_TIMEOUT)
+    apply_bootstrap_updates()
+    # Detiene los pedidos pendientes y cierra los procesos del motor
+    session.close()
+    if engine_service is not None:
+        engine_service.close()
+    # Guarda los analisis para la proxima sesion
+    if analysis_cache is not None:
+        analysis_cache.save(ANALYSIS_CACHE_FILE)
+    close_book_and_tablebases()
+    if led_output is not None:
+        led_output.close()
+    if spectator_server is not None:
+        spectator_server.close()
+    if journal is not None:
+        journal.close()
+    metrics.close()
+
+# --- SECCION 6: MODOS SIN VENTANA (PARTIDAS ENTRE MOTORES Y ANALISIS DE PGN) ---
+
+# Cantidad maxima de jugadas (medias) antes de declarar tablas en el modo match
+MATCH_MAX_PLIES = 400
+
+# Motores abiertos dentro de cada proceso trabajador del match: "A" y "B"
+match_engines = {}
+
+def parse_limit(text):
+    # Convierte un texto como "time=0.4,depth=12" en un Limit del motor
+    values = {}
+    for part in text.split(","):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in ("time", "depth", "nodes"):
+            raise argparse.ArgumentTypeError(f"limite desconocido: {name}")
+        values[name] = float(value) if name == "time" else int(value)
+    return chess.engine.Limit(**values)
+
+def limit_text(text):
+    # Valida un limite escrito en la linea de comandos y lo devuelve como texto
+    try:
+        parse_limit(text)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(f"limite invalido: {text} ({e})")
+    return text
+
+def parse_options(items):
+    # Convierte una lista ["Hash=64", "Threads=1"] en un diccionario de opciones UCI
+    options = {}
+    for item in items or []:
+        name, _, value = item.partition("=")
+        options[name.strip()] = value.strip()
+    return options
+
+def init_match_worker(engine_path, options_a, options_b):
+    # Se ejecuta una vez en cada proceso trabajador
+    # Abre los dos motores y los deja listos para todas las partidas de ese proceso
+    import multiprocessing.util
+    for side, options in (("A", options_a), ("B", options_b)):
+        engine = chess.engine.SimpleEngine.popen_uci(engine_path)
+        if options:
+            engine.configure(options)
+        match_engines[side] = engine
+    # Cierra los motores cuando termina el proceso trabajador
+    # (atexit no corre en los procesos de multiprocessing)
+    multiprocessing.util.Finalize(None, close_match_engines, exitpriority=10)
+
+def close_match_engines():
+    # Cierra los motores del proceso trabajador
+    for engine in match_engines.values():
+        try:
+            engine.quit()
+        except Exception:
+            pass
+    match_engines.clear()
+
+def play_match_game(task):
+    # Juega una partida completa entre los motores A y B (en un proceso trabajador)
+    # Devuelve el PGN y las estadisticas de tiempo y nodos de cada lado
+    import chess.pgn
+    current_board = chess.Board(task["fen"]) if task["fen"] else chess.Board()
+    white = "A" if task["a_is_white"] else "B"
+    black = "B" if task["a_is_white"] else "A"
+    stats = {"A": {"moves": 0, "time": 0.0, "nodes": 0}, "B": {"moves": 0, "time": 0.0, "nodes": 0}}
+    
+    while not current_board.is_game_over(claim_draw=True) and len(current_board.move_stack) < MATCH_MAX_PLIES:
+        side = white if current_board.turn == chess.WHITE else black
+        start = time.perf_counter()
+        # Manda solo las jugadas desde la ultima captura o jugada de peon
+        result = match_engines[side].play(take_snapshot(current_board).board(), task["limits"][side], info=chess.engine.INFO_BASIC)
+        elapsed = time.perf_counter() - start
+        # Acumula las estadisticas de este lado
+        stats[side]["moves"] += 1
+        stats[side]["time"] += elapsed
+        stats[side]["nodes"] += result.info.get("nodes", 0)
+        if result.move is None:
+            break
+        current_board.push(result.move)
+    
+    # Resultado: si se llego al maximo de jugadas se declaran tablas
+    outcome = current_board.outcome(claim_draw=True)
+    result_text = outcome.result() if outcome else "1/2-1/2"
+    
+    # Arma el PGN de la partida
+    game = chess.pgn.Game.from_board(current_board)
+    game.headers["Event"] = "KChess match"
+    game.headers["Round"] = str(task["round"])
+    game.headers["White"] = f"{white} ({task['labels'][white]})"
+    game.headers["Black"] = f"{black} ({task['labels'][black]})"
+    game.headers["Result"] = result_text
+    
+    # Puntos de A: 1 si gana, 0.5 tablas, 0 si pierde
+    if result_text == "1/2-1/2":
+        score_a = 0.5
+    else:
+        white_won = result_text == "1-0"
+        score_a = 1.0 if white_won == task["a_is_white"] else 0.0
+    return {"round": task["round"], "pgn": str(game), "score_a": score_a, "stats": stats}
+
+def run_match(args):
+    # Juega N partidas entre dos configuraciones del motor sin abrir ventana
+    import concurrent.futures
+    engine_path = args.engine or ensure_engine()
+    if not engine_path:
+        print("No se pudo configurar el motor")
+        return 1
+    
+    # Posiciones iniciales: las de --fen y las del archivo --fens (una por linea)
+    fens = list(args.fen or [])
+    if args.fens:
+        with open(args.fens, "r", encoding="utf-8") as f:
+            fens += [line.strip() for line in f if line.strip()]
+    if not fens:
+        fens = [None]
+    
+    labels = {"A": args.limit_a, "B": args.limit_b}
+    limits = {"A": parse_limit(args.limit_a), "B": parse_limit(args.limit_b)}
+    
+    # Cada posicion se juega con colores alternados para que sea justo
+    tasks = [{
+        "round": i + 1,
+        "fen": fens[(i // 2) % len(fens)],
+        "a_is_white": i % 2 == 0,
+        "limits": limits,
+        "labels": labels,
+    } for i in range(args.games)]
+    
+    # Un proceso por nucleo (cada uno con sus dos motores de un hilo)
+    jobs = args.jobs or os.cpu_count() or 1
+    totals = {"A": {"moves": 0, "time": 0.0, "nodes": 0}, "B": {"moves": 0, "time": 0.0, "nodes": 0}}
+    wins = draws = losses = 0
+    
+    pgn_file = open(args.pgn, "w", encoding="utf-8") if args.pgn else None
+    try:
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=jobs,
+            initializer=init_match_worker,
+            initargs=(engine_path, parse_options(args.option_a), parse_options(args.option_b)),
+        ) as pool:
+            for game in pool.map(play_match_game, tasks):
+                # Escribe cada partida apenas termina
+                if pgn_file:
+                    pgn_file.write(game["pgn"] + "\n\n")
+                    pgn_file.flush()
+                if game["score_a"] == 1.0:
+                    wins += 1
+                elif game["score_a"] == 0.5:
+                    draws += 1
+                else:
+                    losses += 1
+                for side in ("A", "B"):
+                    for name in ("moves", "time", "nodes"):
+                        totals[side][name] += game["stats"][side][name]
+                print(f"Partida {game['round']}/{args.games}: A {game['score_a']}")
+    finally:
+        if pgn_file:
+            pgn_file.close()
+    
+    # Resumen final desde el punto de vista de A
+    summary = {"games": args.games, "wins_a": wins, "draws": draws, "losses_a": losses}
+    for side in ("A", "B"):
+        t = totals[side]
+        summary[side] = {
+            "limit": labels[side],
+            "avg_move_time": t["time"] / t["moves"] if t["moves"] else 0.0,
+            "nps": int(t["nodes"] / t["time"]) if t["time"] else 0,
+        }
+    print(f"A vs B: +{wins} ={draws} -{losses}")
+    for side in ("A", "B"):
+        print(f"  {side} ({labels[side]}): {summary[side]['avg_move_time']:.3f} s/jugada, {summary[side]['nps']} nodos/s")
+    if args.summary:
+        with open(args.summary, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+    return 0
+
+# Perdida en centipeones (desde el lado que mueve) para marcar cada error
+# en el analisis de PGN: ?! imprecision, ? error, ?? error grave
+INACCURACY_CP = 50
+MISTAKE_CP = 100
+BLUNDER_CP = 300
+
+# Valor en centipeones que se usa para un mate al comparar puntajes
+MATE_CP = 10000
+
+def entry_score(entry, color):
+    # Convierte el puntaje guardado (desde blancas) a centipeones desde el lado dado
+    if entry["mate"] is not None:
+        cp = MATE_CP - abs(entry["mate"]) if entry["mate"] > 0 else -MATE_CP + abs(entry["mate"])
+    else:
+        cp = entry["cp"] or 0
+    return cp if color == chess.WHITE else -cp
+
+def eval_comment(entry):
+    # Arma el comentario [%eval ...] estandar para el PGN
+    if entry["mate"] is not None:
+        return f"[%eval #{entry['mate']}]"
+    return f"[%eval {(entry['cp'] or 0) / 100:.2f}]"
+
+async def analyse_position(service, cache, current_board, limit):
+    # Analiza una posicion (o la toma del cache) y devuelve la entrada del cache
+    entry = cache.get_entry(current_board, limit)
+    if entry is not None:
+        return entry
+    snapshot = take_snapshot(current_board)
+    job = EngineJob(0, snapshot, None, loop=service.loop)
+    result = await service.play(snapshot.board(), limit, job)
+    if result is None or result.move is None:
+        return None
+    cache.put(current_board, limit, result)
+    return cache.get_entry(current_board, limit)
+
+async def annotate_game(service, cache, game, limit):
+    # Analiza todas las posiciones de una partida en paralelo y agrega
+    # evaluaciones, mejores jugadas y marcas de error al PGN
+    import chess.pgn
+    nodes = list(game.mainline())
+    boards = [game.board()] + [node.board() for node in nodes]
+    
+    # Las posiciones repetidas dentro de la partida se analizan una sola vez
+    tasks = {}
+    keys = []
+    for position in boards:
+        key = AnalysisCache.key(position, limit)
+        keys.append(key)
+        if key not in tasks and not position.is_game_over():
+            tasks[key] = asyncio.ensure_future(analyse_position(service, cache, position, limit))
+    results = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+    entries = [results.get(key) for key in keys]
+    
+    for i, node in enumerate(nodes):
+        before, after = entries[i], entries[i + 1]
+        mover = boards[i].turn
+        if after is not None:
+            node.comment = (node.comment + " " if node.comment else "") + eval_comment(after)
+        if before is None:
+            continue
+        # Perdida del que movio: puntaje antes menos puntaje despues (desde su lado)
+        if after is not None:
+            loss = entry_score(before, mover) - entry_score(after, mover)
+        elif boards[i + 1].is_checkmate():
+            loss = 0
+        else:
+            # Tablas por ahogado o material: compara contra 0
+            loss = entry_score(before, mover)
+        if loss >= BLUNDER_CP:
+            node.nags.add(chess.pgn.NAG_BLUNDER)
+        elif loss >= MISTAKE_CP:
+            node.nags.add(chess.pgn.NAG_MISTAKE)
+        elif loss >= INACCURACY_CP:
+            node.nags.add(chess.pgn.NAG_DUBIOUS_MOVE)
+        # Si hubo error muestra la mejor jugada como variante
+        best = chess.Move.from_uci(before["move"])
+        if loss >= INACCURACY_CP and best != node.move:
+            node.parent.add_variation(best, comment=eval_comment(before))
+    return game
+
+def run_annotate(args):
+    # Analiza un archivo PGN partida por partida sin cargarlo entero en memoria
+    # y escribe el PGN anotado a medida que avanza (se puede retomar)
+    import chess.pgn
+    engine_path = args.engine or ensure_engine()
+    if not engine_path:
+        print("No se pudo configurar el motor")
+        return 1
+    output = args.output or os.path.splitext(args.input)[0] + "_anotado.pgn"
+    progress_path = output + ".progress"
+    limit = parse_limit(args.limit)
+    
+    # Partidas ya escritas en una corrida anterior (para retomar)
+    done = 0
+    if os.path.exists(progress_path) and os.path.exists(output):
+        with open(progress_path, "r", encoding="utf-8") as f:
+            done = json.load(f).get("games", 0)
+        print(f"Retomando despues de {done} partidas")
+    elif os.path.exists(output):
+        os.remove(output)
+    
+    # Un motor de un hilo por nucleo; el cache evita repetir posiciones
+    engines = args.engines or os.cpu_count() or 1
+    options = {"Threads": 1}
+    options.update(parse_options(args.option))
+    cache = AnalysisCache(args.cache_size)
+    cache.load(args.cache)
+    service = EngineService(engine_path, engines, options)
+    service.start()
+    
+    count = 0
+    start = time.perf_counter()
+    # Partidas en analisis: (numero, future) en el orden del archivo
+    # Varias a la vez para que los motores no queden sin trabajo al final de cada
+    # partida ni mientras se escribe; se escriben siempre en orden
+    pending = deque()
+    in_flight = max(1, args.in_flight)
+    
+    def write_next(target):
+        number, future = pending.popleft()
+        annotated = future.result()
+        target.write(str(annotated) + "\n\n")
+        target.flush()
+        # Guarda el avance despues de cada partida escrita (todas las anteriores ya estan)
+        with open(progress_path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({"games": number}, f)
+        os.replace(progress_path + ".tmp", progress_path)
+        elapsed = time.perf_counter() - start
+        print(f"Partida {number} anotada ({elapsed:.1f} s)")
+    
+    try:
+        with open(args.input, "r", encoding="utf-8", errors="replace") as source, \
+                open(output, "a", encoding="utf-8") as target:
+            while True:
+                game = chess.pgn.read_game(source)
+                if game is None:
+                    break
+                count += 1
+                # Salta las partidas ya anotadas
+                if count <= done:
+                    continue
+                pending.append((count, service.run(annotate_game(service, cache, game, limit))))
+                if len(pending) >= in_flight:
+                    write_next(target)
+            while pending:
+                write_next(target)
+    finally:
+        # Si se corto a mitad de camino no sigue analizando lo que no se va a escribir
+        for _, future in pending:
+            future.cancel()
+        service.close()
+        cache.save(args.cache)
+    # Termino todo: el archivo de avance ya no hace falta
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+    print(f"{count} partidas en {output}")
+    return 0
+
+# --- SECCION 7: PRUEBAS DE RENDIMIENTO (BENCHMARK) ---
+
+# Posiciones fijas para que cada corrida mida exactamente lo mismo
+# inicio, medio juego con muchas jugadas, medio juego real, final y coronacion
+BENCH_FENS = [
+    chess.STARTING_FEN,
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r2q1rk1/pp2ppbp/2p2np1/6B1/3PP1b1/Q1P2N2/P4PPP/3RKB1R b K - 0 13",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+    "4k3/1P6/8/8/8/8/6p1/4K3 w - - 0 1",
+]
+
+# Partida fija (Ruy Lopez cerrada) que se juega jugada por jugada
+BENCH_GAME = ("e2e4 e7e5 g1f3 b8c6 f1b5 a7a6 b5a4 g8f6 e1g1 f8e7 f1e1 b7b5 "
+              "a4b3 d7d6 c2c3 e8g8 h2h3 c6a5 b3c2 c7c5 d2d4 d8c7").split()
+
+# Limite del motor para medir la ida y vuelta (rapido y repetible)
+BENCH_ENGINE_LIMIT = "depth=1"
+
+class HeadlessElement:
+    # Elemento de ventana sin pantalla: acepta las mismas llamadas que un
+    # boton o texto de FreeSimpleGUI pero no dibuja nada
+    def __init__(self):
+        self.Widget = self
+        self.image = None
+
+    def update(self, *args, **kwargs):
+        pass
+
+    def config(self, **kwargs):
+        pass
+
+class HeadlessWindow:
+    # Ventana falsa para medir update_ui y los clics sin Tk ni pantalla
+    def __init__(self):
+        self.elements = {}
+
+    def __getitem__(self, key):
+        element = self.elements.get(key)
+        if element is None:
+            element = self.elements[key] = HeadlessElement()
+        return element
+
+    def refresh(self):
+        pass
+
+    def write_event_value(self, key, value):
+        pass
+
+class HeadlessImage:
+    # Imagen falsa con el tamano de las piezas (reemplaza a tk.PhotoImage)
+    def __init__(self, size):
+        self.size = size
+
+    def width(self):
+        return self.size
+
+    def height(self):
+        return self.size
+
+class HeadlessCanvas:
+    # Lienzo falso para medir el tablero dibujado con CanvasBoard
+    def __init__(self):
+        self.items = 0
+
+    def create_rectangle(self, *args, **kwargs):
+        self.items += 1
+        return self.items
+
+    def create_image(self, *args, **kwargs):
+        self.items += 1
+        return self.items
+
+    def itemconfig(self, item, **kwargs):
+        pass
+
+def square_event(sq):
+    # Clave del boton (fila, columna) de una casilla, igual que los clics reales
+    return (chess.square_rank(sq), chess.square_file(sq))
+
+def bench_move(current_board):
+    # Primera jugada legal en orden UCI (siempre la misma para la misma posicion)
+    return min(current_board.legal_moves, key=lambda m: m.uci())
+
+def bench_set_position(window, fen):
+    # Pone una posicion y la dibuja completa (fuera de la medicion)
+    session.board.set_fen(fen)
+    session.reset_selection()
+    # Las posiciones de prueba no deben abrir el mensaje de fin de juego
+    session.game_over_notified = True
+    update_ui(window, full=True)
+
+def bench_operations(window, service):
+    # Lista de operaciones medidas: (nombre, preparar(fen), antes(), medir())
+    # preparar corre una vez por posicion y antes corre en cada vuelta,
+    # ninguno de los dos entra en el tiempo medido
+    state = {}
+
+    def prepare_position(fen):
+        bench_set_position(window, fen)
+        move = bench_move(session.board)
+        state["move"] = move
+        state["from"] = square_event(move.from_square)
+        state["to"] = square_event(move.to_square)
+
+    def forget_frame():
+        session.frame_cache["key"] = None
+
+    def toggle_move():
+        # Alterna entre la posicion y la posicion despues de una jugada
+        # para que el dibujo incremental siempre tenga casillas que cambiar
+        if session.board.move_stack:
+            session.board.pop()
+        else:
+            session.board.push(state["move"])
+
+    def select_piece():
+        session.reset_selection()
+        forget_frame()
+
+    def selected_piece():
+        # Deja la pieza seleccionada y deshace la jugada de la vuelta anterior
+        if session.board.move_stack:
+            session.board.pop()
+        session.reset_selection()
+        handle_square_click(window, state["from"])
+
+    def all_colors():
+        for sq in chess.SQUARES:
+            get_sq_color(sq)
+
+    def select_and_frame():
+        forget_frame()
+        session.reset_selection()
+        handle_square_click(window, state["from"])
+        forget_frame()
+
+    operations = [
+        ("update_ui completo", prepare_position, None, lambda: update_ui(window, full=True)),
+        ("update_ui incremental", prepare_position, toggle_move, lambda: update_ui(window)),
+        ("compute_frame", prepare_position, select_and_frame, compute_frame),
+        ("get_sq_color x64", prepare_position, forget_frame, all_colors),
+        ("clic seleccionar", prepare_position, select_piece, lambda: handle_square_click(window, state["from"])),
+        ("clic mover", prepare_position, selected_piece, lambda: handle_square_click(window, state["to"])),
+    ]
+    
+    if service is not None:
+        limit = parse_limit(BENCH_ENGINE_LIMIT)
+
+        def engine_round_trip():
+            snapshot = take_snapshot(session.board)
+            job = EngineJob(0, snapshot, None, loop=service.loop)
+            service.run(service.play(snapshot.board(), limit, job)).result()
+
+        operations.append(("motor ida y vuelta", lambda fen: session.board.set_fen(fen), None, engine_round_trip))
+    return operations
+
+def bench_game(window):
+    # Juega la partida fija con clics como lo haria el jugador
+    # Devuelve una sola operacion que mide cada jugada (dos clics + dibujo)
+    def prepare(fen):
+        bench_set_position(window, chess.STARTING_FEN)
+        state["ply"] = 0
+
+    def before():
+        # Al terminar la partida vuelve a empezar desde el inicio
+        if state["ply"] == len(BENCH_GAME):
+            prepare(None)
+        move = chess.Move.from_uci(BENCH_GAME[state["ply"]])
+        state["from"] = square_event(move.from_square)
+        state["to"] = square_event(move.to_square)
+        state["ply"] += 1
+
+    def play():
+        handle_square_click(window, state["from"])
+        handle_square_click(window, state["to"])
+
+    state = {}
+    return ("partida fija (2 clics)", prepare, before, play)
+
+def bench_measure(operation, fens, iterations, warmup):
+    # Mide una operacion: primero tiempos y despues memoria en otra pasada
+    # (tracemalloc hace todo mas lento, por eso no se mezcla con los tiempos)
+    import tracemalloc
+    name, prepare, before, action = operation
+    per_position = max(1, iterations // len(fens))
+    
+    times = []
+    for fen in fens:
+        prepare(fen)
+        for i in range(warmup + per_position):
+            if before:
+                before()
+            start = time.perf_counter()
+            action()
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                times.append(elapsed * 1e6)
+    
+    peaks = []
+    blocks = []
+    tracemalloc.start()
+    try:
+        for fen in fens:
+            prepare(fen)
+            for _ in range(min(per_position, 50)):
+                if before:
+                    before()
+                # Contar bloques es caro: se hace una sola vez por operacion
+                base_blocks = len(tracemalloc.take_snapshot().traces) if not blocks else None
+                tracemalloc.reset_peak()
+                base_size = tracemalloc.get_traced_memory()[0]
+                action()
+                current, peak = tracemalloc.get_traced_memory()
+                peaks.append((peak - base_size) / 1024)
+                if base_blocks is not None:
+                    blocks.append(len(tracemalloc.take_snapshot().traces) - base_blocks)
+    finally:
+        tracemalloc.stop()
+    
+    times.sort()
+    return {
+        "n": len(times),
+        "mean": sum(times) / len(times),
+        "p50": percentile(times, 0.50),
+        "p90": percentile(times, 0.90),
+        "p99": percentile(times, 0.99),
+        "max": times[-1],
+        "peak_kb": sum(peaks) / len(peaks),
+        "blocks": blocks[0] if blocks else 0,
+    }
+
+def run_bench(args):
+    # Mide sin ventana el dibujo, los colores, los clics y opcionalmente el motor
+    # Con --save guarda los resultados y con --compare avisa si algo empeoro
+    global board_canvas
+    import random
+    random.seed(0)
+    fens = args.fen or BENCH_FENS
+    
+    # Sin bot ni asistente: los clics no piden nada al motor
+    session.is_bot_enabled = False
+    session.is_assistant_enabled = False
+    session.engine_suggestion = None
+    window = HeadlessWindow()
+    piece_photos.clear()
+    for symbol in list(PIECE_IMAGES) + ['.']:
+        piece_photos[symbol] = HeadlessImage(IMG_SIZE)
+    # Con --renderer canvas el tablero se dibuja en un lienzo en vez de 64 botones
+    board_canvas = CanvasBoard(HeadlessCanvas(), IMG_SIZE) if args.renderer == "canvas" else None
+    
+    service = None
+    if args.engine:
+        service = EngineService(args.engine, 1, {"Threads": 1})
+        service.start()
+    # El planificador solo se usa para cancelar (no hay pedidos al motor)
+    session.scheduler = EngineScheduler(service, session=session)
+    
+    results = {}
+    try:
+        for operation in bench_operations(window, service) + [bench_game(window)]:
+            if args.only and not any(word in operation[0] for word in args.only):
+                continue
+            results[operation[0]] = bench_measure(operation, fens, args.iterations, args.warmup)
+    finally:
+        if service is not None:
+            service.close()
+    
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f).get("results", {})
+    
+    # Tabla de resultados en microsegundos
+    print(f"{'operacion':<26}{'n':>6}{'media':>10}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}{'KB':>8}{'bloques':>9}")
+    regressions = []
+    for name, r in results.items():
+        line = (f"{name:<26}{r['n']:>6}{r['mean']:>10.1f}{r['p50']:>10.1f}{r['p90']:>10.1f}"
+                f"{r['p99']:>10.1f}{r['max']:>10.1f}{r['peak_kb']:>8.1f}{r['blocks']:>9}")
+        # Compara la mediana (la menos afectada por ruido del sistema)
+        old = baseline.get(name)
+        if old and old["p50"] > 0:
+            change = (r["p50"] - old["p50"]) / old["p50"] * 100
+            line += f"  {change:+.0f}%"
+            if change > args.threshold:
+                regressions.append(name)
+                line += " REGRESION"
+        print(line)
+    
+    if args.save:
+        data = {
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "iterations": args.iterations,
+            "renderer": args.renderer,
+            "results": results,
+        }
+        with open(args.save + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(args.save + ".tmp", args.save)
+        print(f"Resultados guardados en {args.save}")
+    
+    if regressions:
+        print(f"Mas lento que la base (>{args.threshold:.0f}%): {', '.join(regressions)}")
+        return 1
+    return 0
+
+def run_cli(argv):
+    # Lee los argumentos; sin argumentos abre la ventana del juego
+    parser = argparse.ArgumentParser(description="Ajedrez con Stockfish")
+    commands = parser.add_subparsers(dest="command")
+    
+    # Modo match: partidas entre dos configuraciones del motor
+    match = commands.add_parser("match", help="partidas motor contra motor sin ventana")
+    match.add_argument("--games", type=int, default=2, help="cantidad de partidas")
+    match.add_argument("--limit-a", type=limit_text, default="time=0.4", help="limite del motor A (time=,depth=,nodes=)")
+    match.add_argument("--limit-b", type=limit_text, default="time=0.4", help="limite del motor B (time=,depth=,nodes=)")
+    match.add_argument("--option-a", action="append", help="opcion UCI del motor A (Nombre=valor)")
+    match.add_argument("--option-b", action="append", help="opcion UCI del motor B (Nombre=valor)")
+    match.add_argument("--fen", action="append", help="posicion inicial (se puede repetir)")
+    match.add_argument("--fens", help="archivo con posiciones iniciales, una por linea")
+    match.add_argument("--engine", help="ruta al motor (por defecto el de engines/)")
+    match.add_argument("--jobs", type=int, help="procesos en paralelo (por defecto un nucleo cada uno)")
+    match.add_argument("--pgn", help="archivo donde guardar las partidas")
+    match.add_argument("--summary", help="archivo JSON con el resumen")
+    
+    # Modo annotate: analiza un archivo PGN y escribe otro con anotaciones
+    annotate = commands.add_parser("annotate", help="anota un archivo PGN con el motor")
+    annotate.add_argument("input", help="archivo PGN de entrada")
+    annotate.add_argument("--output", help="archivo PGN anotado (por defecto <entrada>_anotado.pgn)")
+    annotate.add_argument("--limit", type=limit_text, default="depth=12", help="limite por posicion (time=,depth=,nodes=)")
+    annotate.add_argument("--engines", type=int, help="motores en paralelo (por defecto uno por nucleo)")
+    annotate.add_argument("--in-flight", type=int, default=ANNOTATE_IN_FLIGHT, help="partidas analizandose a la vez")
+    annotate.add_argument("--option", action="append", help="opcion UCI (Nombre=valor)")
+    annotate.add_argument("--cache", default=ANNOTATE_CACHE_FILE, help="archivo del cache de posiciones")
+    annotate.add_argument("--cache-size", type=int, default=200000, help="posiciones maximas en el cache")
+    annotate.add_argument("--engine", help="ruta al motor (por defecto el de engines/)")
+    
+    # Modo bench: mide el rendimiento de la interfaz, los clics y el motor
+    bench = commands.add_parser("bench", help="mide el rendimiento sin ventana")
+    bench.add_argument("--iterations", type=int, default=500, help="vueltas medidas por operacion")
+    bench.add_argument("--warmup", type=int, default=20, help="vueltas sin medir por posicion")
+    bench.add_argument("--fen", action="append", help="posicion a medir (por defecto las de BENCH_FENS)")
+    bench.add_argument("--only", action="append", help="mide solo las operaciones que contienen este texto")
+    bench.add_argument("--engine", help="ruta al motor para medir la ida y vuelta (opcional)")
+    bench.add_argument("--renderer", choices=["buttons", "canvas"], default="buttons", help="tablero a medir: 64 botones o un solo lienzo")
+    bench.add_argument("--save", help="archivo JSON donde guardar los resultados")
+    bench.add_argument("--compare", help="archivo JSON de una corrida anterior para comparar")
+    bench.add_argument("--threshold", type=float, default=20.0, help="porcentaje de mas en p50 que cuenta como regresion")
+    
+    args = parser.parse_args(argv)
+    if args.command == "match":
+        return run_match(args)
+    if args.command == "annotate":
+        return run_annotate(args)
+    if args.command == "bench":
+        return run_bench(args)
+    main()
+    return 0
 
 # Punto de entrada del programa
 if __name__ == '__main__':
-    main()
+    sys.exit(run_cli(sys.argv[1:]))
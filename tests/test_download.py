@@ -0,0 +1,128 @@
+# Pruebas de la descarga y la instalacion del motor con un servidor HTTP local
+import hashlib
+import http.server
+import io
+import os
+import sys
+import tarfile
+import threading
+import zipfile
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kchess
+
+DATA = bytes(range(256)) * 1024
+
+
+class RangeHandler(http.server.BaseHTTPRequestHandler):
+    # Sirve DATA y acepta "Range: bytes=<inicio>-" como un servidor de descargas
+    ranges = []
+
+    def do_GET(self):
+        header = self.headers.get("Range")
+        self.ranges.append(header)
+        start = int(header[len("bytes="):].rstrip("-")) if header else 0
+        if start >= len(DATA):
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{len(DATA)}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = DATA[start:]
+        self.send_response(206 if header else 200)
+        if header:
+            self.send_header("Content-Range", f"bytes {start}-{len(DATA) - 1}/{len(DATA)}")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    RangeHandler.ranges = []
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/stockfish.tar"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def test_download_resumes_with_range(server, tmp_path):
+    path = str(tmp_path / "stockfish.tar")
+    with open(path + ".part", "wb") as f:
+        f.write(DATA[:1000])
+    kchess.download_file(server, path, SHA256)
+    assert RangeHandler.ranges == ["bytes=1000-"]
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(path + ".part")
+
+
+def test_download_wrong_hash_deletes_part(server, tmp_path):
+    path = str(tmp_path / "stockfish.tar")
+    with pytest.raises(ValueError):
+        kchess.download_file(server, path, "0" * 64)
+    assert not os.path.exists(path + ".part")
+    assert not os.path.exists(path)
+
+
+def test_download_already_complete_part(server, tmp_path):
+    # El servidor contesta 416 porque no falta nada: se verifica lo que ya estaba
+    path = str(tmp_path / "stockfish.tar")
+    with open(path + ".part", "wb") as f:
+        f.write(DATA)
+    kchess.download_file(server, path, SHA256)
+    assert RangeHandler.ranges == [f"bytes={len(DATA)}-"]
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def add_tar_member(archive, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+def test_extract_engine_tar_only_engine(tmp_path):
+    archive_path = str(tmp_path / "stockfish-ubuntu-x86-64-avx2.tar")
+    with tarfile.open(archive_path, "w") as archive:
+        add_tar_member(archive, "stockfish/README.md", b"leeme")
+        add_tar_member(archive, "stockfish/src/main.cpp", b"fuente")
+        add_tar_member(archive, "stockfish/stockfish-ubuntu-x86-64-avx2", b"motor")
+        add_tar_member(archive, "stockfish/stockfish.txt", b"notas")
+    target = str(tmp_path / "engine" / "stockfish")
+    os.makedirs(os.path.dirname(target))
+    assert kchess.extract_engine(archive_path, target)
+    with open(target, "rb") as f:
+        assert f.read() == b"motor"
+    assert os.listdir(os.path.dirname(target)) == ["stockfish"]
+
+
+def test_extract_engine_zip_only_engine(tmp_path):
+    archive_path = str(tmp_path / "stockfish-windows-x86-64-avx2.zip")
+    with zipfile.ZipFile(archive_path, "w") as archive:
+        archive.writestr("stockfish/Copying.txt", b"licencia")
+        archive.writestr("stockfish/stockfish-windows-x86-64-avx2.exe", b"motor")
+    target = str(tmp_path / "engine" / "stockfish.exe")
+    os.makedirs(os.path.dirname(target))
+    assert kchess.extract_engine(archive_path, target)
+    with open(target, "rb") as f:
+        assert f.read() == b"motor"
+    assert os.listdir(os.path.dirname(target)) == ["stockfish.exe"]
+
+
+def test_extract_engine_without_engine(tmp_path):
+    archive_path = str(tmp_path / "otro.tar")
+    with tarfile.open(archive_path, "w") as archive:
+        add_tar_member(archive, "docs/README.md", b"leeme")
+    target = str(tmp_path / "stockfish")
+    assert not kchess.extract_engine(archive_path, target)
+    assert not os.path.exists(target)
@@ -0,0 +1,63 @@
+# Pruebas del servidor de espectadores, todo en 127.0.0.1
+import json
+import os
+import socket
+import sys
+import time
+
+import chess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import kchess
+
+
+def start_server():
+    server = kchess.SpectatorServer(host="127.0.0.1", port=0, token="clave", notify=lambda: None)
+    server.start()
+    return server
+
+
+def connect(server):
+    # Se conecta y espera a que el servidor registre al cliente
+    count = len(server.clients)
+    sock = socket.create_connection(("127.0.0.1", server.port), timeout=5)
+    deadline = time.time() + 5
+    while len(server.clients) <= count and time.time() < deadline:
+        time.sleep(0.01)
+    return sock, sock.makefile("r", encoding="utf-8")
+
+
+def test_client_connected_before_first_publish_gets_full_state():
+    server = start_server()
+    try:
+        sock, lines = connect(server)
+        game = kchess.GameSession()
+        game.board.push(chess.Move.from_uci("e2e4"))
+        server.publish(game, game.compute_frame())
+        message = json.loads(lines.readline())
+        assert message["type"] == "full"
+        assert message["moves"] == ["e2e4"]
+        assert message["seq"] == 1
+        sock.close()
+    finally:
+        server.close()
+
+
+def test_late_client_gets_full_state_then_deltas():
+    server = start_server()
+    try:
+        game = kchess.GameSession()
+        server.publish(game, game.compute_frame())
+        sock, lines = connect(server)
+        message = json.loads(lines.readline())
+        assert message["type"] == "full"
+        assert message["moves"] == []
+        game.board.push(chess.Move.from_uci("d2d4"))
+        server.publish(game, game.compute_frame())
+        message = json.loads(lines.readline())
+        assert message["type"] == "delta"
+        assert message["moves"] == ["d2d4"]
+        assert message["seq"] == 2
+        sock.close()
+    finally:
+        server.close()